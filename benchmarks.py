@@ -0,0 +1,261 @@
+"""Timings for the slow stages of commute_analyzer.py on generated data.
+Run with 'python benchmarks.py [stages|parsing|sketch|memory|streaming|coldstart] [rows ...]'."""
+
+import os
+import sys
+import math
+import time
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from commute_analyzer import (duration_clean, distance_conversion, clean_commute_columns, load_samples,
+                              adjust_samples, time_aggregator, daily_averages, distance_variation,
+                              route_tables)
+from plots import (mean_commute_time_plot, daily_commute_time_plot, lost_time_plot,
+                   commute_distance_variation_plot, total_commute_minutes_plot)
+from incremental import CHUNKSIZE, stream_tables
+from sketches import TDigest, merge_digests, rank_error
+from schema import footprint
+from synthetic_data import generate_samples, write_samples_csv, samples_per_day
+
+STAGE_SIZES = [10000, 1000000, 50000000]
+MEMORY_ROWS = 10000000
+STREAM_ROWS = 2000000
+COLD_START_RUNS = 5
+# Modules 'cli.py stats' should never import
+HEAVY_MODULES = ['plotly', 'plots', 'dashboard', 'storage']
+ROWS_PER_ROUTE = 250000
+
+
+def timed(func, *args):
+    """Returns the result of func(*args) and the seconds it took"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def google_text_samples(rows, seed=0):
+    """Duration and distance columns in google's text format, km only since that is all
+    the apply path understands"""
+    rng = np.random.RandomState(seed)
+    minutes = rng.randint(15, 130, rows)
+    durations = np.where(minutes >= 60,
+                         pd.Series(minutes // 60).astype(str) + ' hour ' + pd.Series(minutes % 60).astype(str) + ' mins',
+                         pd.Series(minutes).astype(str) + ' mins')
+    distances = pd.Series(rng.normal(32, 3, rows).round(1)).astype(str) + ' km'
+    return pd.DataFrame({'duration_in_traffic': durations, 'distance': distances})
+
+
+def bench_parsing(rows=1000000):
+    """Compares the Series.apply cleaning path with clean_commute_columns"""
+    df = google_text_samples(rows)
+
+    def apply_path(frame):
+        return (frame['duration_in_traffic'].apply(duration_clean),
+                frame['distance'].apply(distance_conversion))
+
+    (durations, distances), apply_secs = timed(apply_path, df)
+    (cleaned, rejects), bulk_secs = timed(clean_commute_columns, df)
+    assert (cleaned['duration_in_traffic'].values == durations.values).all()
+    assert np.allclose(cleaned['distance'].values, distances.values)
+    print('Parsing {:,} rows: apply {:.2f}s, vectorized {:.2f}s ({:.0f}x)'.format(
+        rows, apply_secs, bulk_secs, apply_secs / bulk_secs))
+
+
+def bench_sketch_accuracy(rows=1000000, partitions=10, seed=0):
+    """Rank error of merged t-digest percentiles against exact quantiles on skewed,
+    whole minute durations, and the size of the digest relative to the raw values"""
+    rng = np.random.RandomState(seed)
+    values = np.round(rng.lognormal(3.7, 0.3, rows))
+    digest = merge_digests(TDigest.from_values(part) for part in np.array_split(values, partitions))
+    ordered = np.sort(values)
+    for q in [0.05, 0.5, 0.9, 0.95, 0.99]:
+        estimate = digest.quantile(q)
+        error = rank_error(ordered, estimate, q)
+        assert error < 0.02, 'rank error {} at q={}'.format(error, q)
+        print('q={:.2f}: exact {:.1f}, sketch {:.2f}, rank error {:.4f}'.format(
+            q, np.quantile(values, q), estimate, error))
+    print('{} centroids for {:,} values ({:.3%} of the memory)'.format(
+        len(digest.means), rows, 2 * digest.means.nbytes / values.nbytes))
+
+
+def legacy_frame(df):
+    """The frame as the pipeline held it before the compact schema: address strings,
+    int64 durations and flags, float64 miles and the hour_min/date objects the stages
+    added. Repeated values share objects to fit in memory, the deep sizes are those of
+    a frame parsed from CSV where every value is its own object."""
+    def objects(values, uniques):
+        codes, found = pd.factorize(values)
+        return pd.Series(np.array(uniques(found), dtype=object)[codes], index=values.index)
+    legacy = df.drop(columns='slot').astype({'duration_in_traffic': 'int64', 'distance': 'float64',
+                                             'is_morning': 'int64'})
+    for column in ['origin', 'destination', 'home', 'work']:
+        legacy[column] = df[column].astype(object)
+    legacy['distance'] = legacy['distance'].round(1)
+    legacy['hour_min'] = objects(df['time'].dt.floor('5min'), lambda found: found.time)
+    legacy['date'] = objects(df['time'].dt.normalize(), lambda found: found.date)
+    return legacy
+
+
+def bench_memory(rows=MEMORY_ROWS, sample=1000000):
+    """Footprint of the cleaned samples frame before and after the compact schema.
+    'sample' rows are generated and cleaned, then repeated up to 'rows'."""
+    routes = max(1, sample // ROWS_PER_ROUTE)
+    days = int(math.ceil(sample / (routes * samples_per_day())))
+    cleaned, _ = clean_commute_columns(adjust_samples(generate_samples(routes=routes, days=days)))
+    df = cleaned.take(np.resize(np.arange(len(cleaned)), rows)).reset_index(drop=True)
+    del cleaned
+    compact = footprint(df)
+    legacy = footprint(legacy_frame(df))
+    table = legacy[['dtype', 'mb']].join(compact[['dtype', 'mb']], how='outer', lsuffix='_before',
+                                         rsuffix='_after')
+    table[['dtype_before', 'dtype_after']] = table[['dtype_before', 'dtype_after']].fillna('-')
+    table.loc['total'] = ['', legacy['mb'].sum(), '', compact['mb'].sum()]
+    table['bytes_per_row_before'] = table['mb_before'] * 1e6 / rows
+    table['bytes_per_row_after'] = table['mb_after'] * 1e6 / rows
+    print('{:,} cleaned samples'.format(rows))
+    print(table.round(1).to_string())
+    print('{:.1f}x smaller'.format(legacy['mb'].sum() / compact['mb'].sum()))
+    return table
+
+
+def measured(func, *args):
+    """Runs func(*args) twice, once for wall time and once under tracemalloc for the
+    peak memory it allocates. Returns the result, seconds and peak megabytes."""
+    result, seconds = timed(func, *args)
+    del result
+    tracemalloc.start()
+    result = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def _aggregate(df):
+    evening, morning = time_aggregator(df)
+    return evening, morning, daily_averages(df), distance_variation(df)
+
+
+def _build_plots(tables):
+    figures = []
+    for route in tables.values():
+        figures.append(mean_commute_time_plot.build(route['morning'].copy(), route['evening'].copy()))
+        figures.append(daily_commute_time_plot.build(route['daily']))
+        figures.append(commute_distance_variation_plot.build(route['distances']))
+        figures.append(total_commute_minutes_plot.build(route['merged']))
+        figures.append(lost_time_plot.build(route['merged'].copy()))
+    return figures
+
+
+def _in_memory_tables(path):
+    return _aggregate(clean_commute_columns(adjust_samples(load_samples(path)))[0])
+
+
+def _largest_difference(tables, streamed):
+    """Largest absolute difference between the values of two sets of analysis tables"""
+    evening, morning, daily, distances = tables
+    pairs = [(evening['duration_in_traffic'], streamed[0]['duration_in_traffic']),
+             (morning['duration_in_traffic'], streamed[1]['duration_in_traffic']),
+             (daily[['duration_in_traffic']], streamed[2][['duration_in_traffic']])]
+    pairs += list(zip(distances, streamed[3]))
+    return max(np.abs(a.values.astype(float) - b.values.astype(float)).max() for a, b in pairs)
+
+
+def bench_streaming(rows=STREAM_ROWS, chunksize=CHUNKSIZE, directory=None):
+    """Time and peak memory of building the analysis tables from a generated CSV in
+    memory and by streaming it through incremental.stream_tables"""
+    routes = max(1, rows // ROWS_PER_ROUTE)
+    days = int(math.ceil(rows / (routes * samples_per_day())))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, 'commute_info.csv')
+        written = write_samples_csv(path, routes=routes, days=days)
+        tables, memory_secs, memory_peak = measured(_in_memory_tables, path)
+        streamed, stream_secs, stream_peak = measured(stream_tables, path, chunksize)
+    print('{:,} samples, {} routes: in memory {:.1f}s {:.0f}MB peak, streamed in chunks of {:,} '
+          '{:.1f}s {:.0f}MB peak, largest difference {:.2g}'.format(
+              written, routes, memory_secs, memory_peak, chunksize, stream_secs, stream_peak,
+              _largest_difference(tables, streamed)))
+    return {'rows': written, 'memory_peak_mb': memory_peak, 'stream_peak_mb': stream_peak}
+
+
+def bench_cold_start(runs=COLD_START_RUNS, days=20, directory=None):
+    """Median wall time over 'runs' fresh interpreters of importing commute_analyzer, of
+    importing plots and of 'cli.py stats' on a small generated CSV, and which of
+    HEAVY_MODULES stats loaded"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, 'commute_info.csv')
+        written = write_samples_csv(path, routes=1, days=days)
+        stats = ['stats', '--source', path, '--processes', '1']
+        commands = [('import commute_analyzer', ['-c', 'import commute_analyzer']),
+                    ('import plots', ['-c', 'import plots']),
+                    ('cli.py stats ({:,} samples)'.format(written), [os.path.join(here, 'cli.py')] + stats)]
+        results = []
+        for name, args in commands:
+            seconds = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                subprocess.run([sys.executable] + args, cwd=here, check=True, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+                seconds.append(time.perf_counter() - start)
+            results.append({'command': name, 'median_seconds': np.median(seconds), 'min_seconds': min(seconds)})
+        check = ('import io, sys, contextlib, cli\n'
+                 'with contextlib.redirect_stdout(io.StringIO()):\n'
+                 '    cli.main({!r})\n'
+                 'print(" ".join(m for m in {!r} if m in sys.modules))'.format(stats, HEAVY_MODULES))
+        loaded = subprocess.run([sys.executable, '-c', check], cwd=here, check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    results = pd.DataFrame(results)
+    print(results.round(3).to_string(index=False))
+    print('Heavy modules imported by stats: {}'.format(loaded or 'none'))
+    return results
+
+
+def bench_stages(rows, directory=None):
+    """Times and memory profiles each stage of commute_analyzer.main on a generated CSV of
+    about 'rows' samples, one route per ROWS_PER_ROUTE rows. Returns one row per stage."""
+    routes = max(1, rows // ROWS_PER_ROUTE)
+    days = int(math.ceil(rows / (routes * samples_per_day())))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, 'commute_info.csv')
+        written = write_samples_csv(path, routes=routes, days=days)
+        stages = [('load', load_samples),
+                  ('weekend/holiday filter', lambda raw: adjust_samples(raw.copy())),
+                  ('clean', lambda df: clean_commute_columns(df)[0]),
+                  ('aggregate', _aggregate),
+                  ('merge', lambda tables: route_tables(*tables)),
+                  ('plot build', _build_plots)]
+        data, results = path, []
+        for name, func in stages:
+            size = len(data) if isinstance(data, pd.DataFrame) else None
+            try:
+                data, seconds, peak = measured(func, data)
+            except MemoryError:
+                results.append({'stage': name, 'rows_in': size, 'seconds': None, 'peak_mb': None})
+                print('{:,} rows: {} ran out of memory'.format(written, name))
+                break
+            results.append({'stage': name, 'rows_in': size, 'seconds': seconds, 'peak_mb': peak})
+    results = pd.DataFrame(results).assign(rows=written, routes=routes)
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == '__main__':
+    suite = sys.argv[1] if len(sys.argv) > 1 else 'stages'
+    sizes = [int(arg) for arg in sys.argv[2:]]
+    if suite == 'parsing':
+        bench_parsing(*sizes[:1])
+    elif suite == 'sketch':
+        bench_sketch_accuracy(*sizes[:1])
+    elif suite == 'memory':
+        bench_memory(*sizes[:1])
+    elif suite == 'coldstart':
+        bench_cold_start(*sizes[:1])
+    elif suite == 'streaming':
+        for rows in sizes or [STREAM_ROWS]:
+            bench_streaming(rows)
+    else:
+        for rows in sizes or STAGE_SIZES:
+            bench_stages(rows)
@@ -0,0 +1,84 @@
+"""Command line entry point for the commute analysis:
+
+    python cli.py stats [--source commute_info.csv] [--chunksize N]
+    python cli.py plots [--dashboard dashboard.html] [--chunksize N]
+    python cli.py export [--aggregates commute_aggregates.pkl] [--csv DIRECTORY]
+
+stats only prints the statistics and never imports plotly, so it starts quickly enough
+for scripting loops ('python benchmarks.py coldstart' measures it). plots writes the html
+figures (or one dashboard) besides the statistics. export writes the per weekday
+aggregates query_service.py serves and, with --csv, the route summary, slot statistics
+and departure windows as CSV files."""
+
+import os
+import argparse
+from commute_analyzer import (AGGREGATES_PATH, analyze_source, write_outputs, build_aggregates,
+                              write_aggregates)
+from profiling import start_run, finish_run
+
+SOURCE = './commute_info.csv'
+
+
+def stats(args):
+    tables, summary, _ = analyze_source(args.source, args.processes, args.engine, args.chunksize)
+    write_outputs(tables, summary, figures=False)
+
+
+def plots(args):
+    tables, summary, _ = analyze_source(args.source, args.processes, args.engine, args.chunksize)
+    write_outputs(tables, summary, args.dashboard, args.dashboard_mode)
+
+
+def export(args):
+    _, summary, df = analyze_source(args.source, args.processes, args.engine)
+    aggregates = build_aggregates(df, args.engine)
+    write_aggregates(aggregates, args.aggregates)
+    print('Wrote aggregates of {} routes to {}'.format(len(summary), args.aggregates))
+    if args.csv:
+        os.makedirs(args.csv, exist_ok=True)
+        summary.to_csv(os.path.join(args.csv, 'summary.csv'), index=False)
+        for name, table in aggregates.items():
+            table.to_csv(os.path.join(args.csv, name + '.csv'), index=False)
+        print('Wrote summary.csv, {} to {}'.format(', '.join(name + '.csv' for name in aggregates), args.csv))
+
+
+def make_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--source', default=SOURCE, help='commute_info.csv or a storage directory')
+    common.add_argument('--processes', type=int, help='worker processes for several routes, 1 for none')
+    common.add_argument('--engine', choices=['exact', 'sketch'], default='exact',
+                        help='exact percentiles or t-digest estimates')
+    common.add_argument('--report', help='write a JSON report of per stage timings and memory')
+    common.add_argument('--profile', help='also write cProfile stats here (needs --report)')
+    streaming = argparse.ArgumentParser(add_help=False)
+    streaming.add_argument('--chunksize', type=int, help='stream the samples this many rows at a time')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    command = commands.add_parser('stats', parents=[common, streaming], help='print the statistics only')
+    command.set_defaults(func=stats)
+    command = commands.add_parser('plots', parents=[common, streaming], help='write the figures and statistics')
+    command.add_argument('--dashboard', help='write all figures to this one html file')
+    command.add_argument('--dashboard-mode', choices=['inline', 'directory'], default='inline',
+                         help="embed plotly.js in the dashboard or share it as a separate file")
+    command.set_defaults(func=plots)
+    command = commands.add_parser('export', parents=[common], help='write the aggregates for query_service.py')
+    command.add_argument('--aggregates', default=AGGREGATES_PATH, help='where to write the aggregates')
+    command.add_argument('--csv', help='also write the summary, slots and windows tables as CSV here')
+    command.set_defaults(func=export)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.report:
+        start_run(args.report, args.profile)
+    args.func(args)
+    if args.report:
+        finish_run()
+
+
+if __name__ == '__main__':
+    main()
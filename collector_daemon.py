@@ -0,0 +1,165 @@
+"""Long running alternative to putting trip_duration_retriever.py on a cronjob.
+Keeps one process (and one connection pool) alive and polls each route during its own
+collection windows."""
+
+import asyncio
+import collections
+import datetime
+import json
+import random
+import time
+import traceback
+import pandas as pd
+from trip_duration_retriever import HOME, WORK, PWORD, PATH, QUOTA_PATH, csv_writer
+from maps_client import COLUMNS, DISTANCE_MATRIX_URL, MapsClient, get_session, percentile
+from schema import TIMEZONES, DEFAULT_TIMEZONE
+from sample_writer import BufferedSampleWriter
+from response_archive import ARCHIVE_DIR, ResponseArchive
+
+# Hours during which each route is polled, in the local time of its origin: the schedule's
+# 'timezone' when given, else the zone the analyzer assumes (schema.TIMEZONES/DEFAULT_TIMEZONE)
+SCHEDULES = [{'origin': HOME, 'destination': WORK, 'hours': [6, 7, 8, 9]},
+             {'origin': WORK, 'destination': HOME, 'hours': [15, 16, 17, 18]}]
+INTERVAL = 300
+MAX_IN_FLIGHT = 4
+# Fraction of the interval over which the requests of one tick are spread
+JITTER = 0.1
+METRICS_WINDOW = 1000
+
+
+class CollectorDaemon:
+    """Polls the routes of 'schedules' every 'interval' seconds while inside their
+    hours. Ticks are scheduled against absolute deadlines so a slow tick never delays
+    the following ones and at most 'max_in_flight' requests run at once. Requests go
+    through MapsClient.fetch, so routes cached for the current departure bucket are not
+    requested again, its rate limit and daily quota apply and quota or server errors
+    back off exponentially before retrying."""
+
+    def __init__(self, schedules, api_key, path=PATH, writer=csv_writer, interval=INTERVAL,
+                 max_in_flight=MAX_IN_FLIGHT, jitter=JITTER, url=DISTANCE_MATRIX_URL,
+                 metrics_path=None, client=None):
+        self.schedules = schedules
+        self.api_key = api_key
+        self.path = path
+        self.writer = writer
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.jitter = jitter
+        self.url = url
+        self.metrics_path = metrics_path
+        self.session = get_session(pool_size=max_in_flight)
+        self.client = client or MapsClient(api_key, url=url, session=self.session)
+        self.metrics = {'ticks': 0, 'tick_errors': 0, 'samples': 0,
+                        'drift': collections.deque(maxlen=METRICS_WINDOW)}
+        self._semaphore = None
+
+    @staticmethod
+    def timezone(schedule):
+        return schedule.get('timezone') or TIMEZONES.get(schedule['origin'], DEFAULT_TIMEZONE)
+
+    def due_routes(self, when):
+        """Routes whose collection hours include 'when', a naive UTC time"""
+        utc = pd.Timestamp(when).tz_localize('UTC')
+        return [(s['origin'], s['destination']) for s in self.schedules
+                if utc.tz_convert(self.timezone(s)).hour in s['hours']]
+
+    async def run(self, ticks=None):
+        """Runs until cancelled, or for 'ticks' ticks when given"""
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        deadline = (time.time() // self.interval + 1) * self.interval
+        count = 0
+        while ticks is None or count < ticks:
+            await asyncio.sleep(max(0.0, deadline - time.time()))
+            task = asyncio.ensure_future(self.tick(deadline))
+            task.add_done_callback(self.tick_done)
+            pending.add(task)
+            pending = {task for task in pending if not task.done()}
+            deadline += self.interval
+            count += 1
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def tick_done(self, task):
+        """Logs the exception a tick failed with, the following ticks go on"""
+        if task.cancelled() or task.exception() is None:
+            return
+        self.metrics['tick_errors'] += 1
+        err = task.exception()
+        print("Tick failed:")
+        traceback.print_exception(type(err), err, err.__traceback__)
+
+    async def tick(self, deadline):
+        """Collects every route due at 'deadline' and writes them as one batch"""
+        self.metrics['drift'].append(time.time() - deadline)
+        self.metrics['ticks'] += 1
+        when = datetime.datetime.utcfromtimestamp(deadline)
+        # Writes fsync, so they run on worker threads like the requests. Buffering writers
+        # are due by time too, so buffered samples age out between windows.
+        loop = asyncio.get_event_loop()
+        flush_due = getattr(self.writer, 'flush_due', None)
+        if flush_due is not None:
+            await loop.run_in_executor(None, flush_due)
+        routes = self.due_routes(when)
+        if not routes:
+            return
+        records, missing = self.client.split(routes, when)
+        wanted = set(missing)
+        batches = self.client.batches(missing)
+        spread = self.interval * self.jitter
+        results = await asyncio.gather(*[self.fetch(origins, destinations, random.uniform(0, spread))
+                                         for origins, destinations in batches])
+        for (origins, destinations), result in zip(batches, results):
+            if result is not None:
+                records.extend(self.client.store(result, origins, destinations, wanted, when))
+        if records:
+            await loop.run_in_executor(None, self.writer, pd.DataFrame(records, columns=COLUMNS), self.path)
+            self.metrics['samples'] += len(records)
+        self.report()
+
+    async def fetch(self, origins, destinations, delay=0.0):
+        """MapsClient.fetch on a worker thread once 'delay' seconds passed and fewer than
+        max_in_flight requests run"""
+        await asyncio.sleep(delay)
+        async with self._semaphore:
+            return await asyncio.get_event_loop().run_in_executor(None, self.client.fetch, origins, destinations)
+
+    def metrics_summary(self):
+        """Counters plus p50/p99 scheduling drift in milliseconds, and the client's cache,
+        request, quota and latency metrics"""
+        summary = {key: value for key, value in self.metrics.items()
+                   if not isinstance(value, collections.deque)}
+        summary.update(self.client.metrics_summary())
+        drift = list(self.metrics['drift'])
+        for q in [50, 99]:
+            value = percentile(drift, q)
+            summary['drift_p{}_ms'.format(q)] = None if value is None else round(value * 1000, 2)
+        return summary
+
+    def report(self):
+        summary = self.metrics_summary()
+        print("Tick {ticks}: {samples} samples, drift p99 {drift_p99_ms} ms, "
+              "latency p50 {latency_p50_ms} ms, cache hit rate {cache_hit_rate}, "
+              "quota remaining {quota_remaining}".format(**summary))
+        if self.metrics_path:
+            with open(self.metrics_path, 'w') as f:
+                json.dump(summary, f)
+
+
+def main():
+    archive = ResponseArchive(ARCHIVE_DIR)
+    writer = BufferedSampleWriter(PATH)
+    client = MapsClient(PWORD, session=get_session(pool_size=MAX_IN_FLIGHT), quota_path=QUOTA_PATH, archive=archive)
+    daemon = CollectorDaemon(SCHEDULES, PWORD, writer=writer, metrics_path='./collector_metrics.json', client=client)
+    try:
+        asyncio.get_event_loop().run_until_complete(daemon.run())
+    except KeyboardInterrupt:
+        print(json.dumps(daemon.metrics_summary()))
+    finally:
+        writer.close()
+        archive.close()
+
+
+if __name__ == '__main__':
+    print("Starting commute collector daemon")
+    main()
@@ -1,37 +1,120 @@
-"""Takes in google API commute data and returns statistics and figures"""
+"""Takes in google API commute data and returns statistics and figures.
 
+plotly (through plots and dashboard), pyarrow (through storage) and the holiday calendar
+are only imported by the functions that need them, so printing statistics never pays for
+them; see cli.py for the stats/plots/export commands."""
+
+import numpy as np
 import pandas as pd
-from pandas.tseries.holiday import USFederalHolidayCalendar
 import re
-import datetime
-from plots import (mean_commute_time_plot, daily_commute_time_plot, lost_time_plot,
-                   commute_distance_variation_plot, total_commute_minutes_plot)
+import os
+import sys
+from functools import lru_cache
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from sketches import group_digests
+from profiling import instrumented
+from optimizer import departure_windows
+from rollups import build_rollups, timeline
+from schema import DTYPES, DEFAULT_TIMEZONE, TIMEZONES, minute_slots, slot_labels, route_categories, used_categories
 
 # TODO: add assertions/tests, more flexibility for when it might be implemented in the future, additional statistics
 
 HOURS_OF_INTEREST = [6, 7, 8, 9, 15, 16, 17, 18]
-HOLIDAYS = USFederalHolidayCalendar().holidays('2018', '2020')
+MORNING_BEFORE_HOUR = 11
 KM_2_MILES = 1.609
+SLOT_MINUTES = 5
+# Rows per chunk when streaming samples, see load_sample_chunks
+CHUNKSIZE = 200000
+# Gap between morning and evening departures paired by the total commute plots
+PLOT_SPREAD_MINUTES = 8 * 60
+# A route is a home/work pair, the morning origin is home and the evening origin is work
+ROUTE_KEYS = ['home', 'work']
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri']
+AGGREGATES_PATH = './commute_aggregates.pkl'
+# Additional percentiles reported by the sketch engine of time_aggregator
+SKETCH_PERCENTILES = [90, 99]
+# Google's text formats, e.g. '1 day 2 hours', '1 hour 5 mins', '45 mins', '12.3 km', '0.8 mi'
+DURATION_PATTERN = (r'^\s*(?:(?P<days>\d+)\s*days?)?\s*(?:(?P<hours>\d+)\s*(?:hours?|hrs?|h))?'
+                    r'\s*(?:(?P<mins>\d+)\s*(?:mins?|minutes?))?\s*$')
+DISTANCE_PATTERN = r'^\s*(?P<value>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>km|mi|m|ft)\s*$'
+MILES_PER_UNIT = {'km': 1 / KM_2_MILES, 'mi': 1.0, 'm': 1 / (KM_2_MILES * 1000), 'ft': 1 / 5280}
+
+
+@instrumented()
+def load_samples(source='./commute_info.csv', start=None, end=None, routes=None):
+    """Loads raw samples from a commute_info.csv or a partitioned store directory. With a
+       store only the partitions within start/end and the given routes are read"""
+    if os.path.isdir(source):
+        from storage import read_samples
+        return read_samples(source, start=start, end=end, routes=routes)
+    return pd.read_csv(source)
+
+
+def load_sample_chunks(source='./commute_info.csv', chunksize=CHUNKSIZE, start=None, end=None, routes=None):
+    """load_samples in pieces: frames of at most 'chunksize' rows of a CSV, or of whole
+    partitions of a store directory adding up to about 'chunksize' rows"""
+    if os.path.isdir(source):
+        from storage import iter_samples
+        return iter_samples(source, start=start, end=end, routes=routes, chunksize=chunksize)
+    return pd.read_csv(source, chunksize=chunksize)
+
+
+def time_date_adjustments(csv_loc='./commute_info.csv', start=None, end=None, routes=None,
+                          timezones=None):
+    """Converts UTC sample times to the local time of each route (daylight savings
+       included), keeps weekday, non holiday samples within HOURS_OF_INTEREST and flags
+       mornings. 'csv_loc' can also be a storage directory, see load_samples"""
+    return adjust_samples(load_samples(csv_loc, start=start, end=end, routes=routes), timezones)
+
 
+@lru_cache(maxsize=None)
+def holiday_dates(first_year, last_year):
+    """US federal holidays from the start of first_year to the end of last_year"""
+    from pandas.tseries.holiday import USFederalHolidayCalendar
+    return USFederalHolidayCalendar().holidays(str(first_year), '{}-12-31'.format(last_year))
 
-def time_date_adjustments(csv_loc='./commute_info.csv'):
-    """Adjusting for daylight savings, making eastern standard time, dropping holidays.
-       Make sure you adjust the daylightsavings conditions based on to adjust for dates of
-       use"""
-    df = pd.read_csv(csv_loc)
-    df['time'] = pd.to_datetime(df['time']) - pd.Timedelta(5, unit='h')
-    df['time'] = df.time.dt.round('1min')
-    # Adjusting or daylight savings
-    daylight = (df['time'] < datetime.date(2018, 11, 4))
-    df.loc[daylight, 'time'] = df.loc[daylight, 'time'] + pd.Timedelta(1, unit='h')
-    # Ensuring there are no times outside of HOURS_OF_INTEREST
-    df = df.drop(df.loc[~df['time'].dt.hour.isin(HOURS_OF_INTEREST)].index)
-    df.reset_index(drop=True, inplace=True)
-    # Dropping holidays
-    df = df.drop(df.loc[df['time'].dt.date.isin(HOLIDAYS)].index)
-    df.reset_index(drop=True, inplace=True)
-    # Adding Morning/Evening Dummy Variable
-    df['is_morning'] = df.time.apply(lambda x: 1 if x.hour < 11 else 0)
+
+def to_local_time(utc, zones):
+    """Converts naive UTC timestamps to naive local times in the IANA timezone of each row"""
+    if zones.nunique() == 1:
+        return utc.dt.tz_localize('UTC').dt.tz_convert(zones.iloc[0]).dt.tz_localize(None)
+    local = pd.Series(pd.NaT, index=utc.index, dtype=utc.dtype)
+    for zone in zones.unique():
+        rows = zones == zone
+        local[rows] = utc[rows].dt.tz_localize('UTC').dt.tz_convert(zone).dt.tz_localize(None)
+    return local
+
+
+@instrumented()
+def adjust_samples(df, timezones=None):
+    """The time adjustments and filters of time_date_adjustments on an already loaded frame.
+    'timezones' maps origin addresses to IANA timezones, defaulting to TIMEZONES"""
+    if df.empty:
+        df = df.assign(time=pd.to_datetime(df['time']), is_morning=False)
+        return add_route_keys(df.assign(slot=minute_slots(df['time'], SLOT_MINUTES)))
+    zones = df['origin'].map(timezones or TIMEZONES).fillna(DEFAULT_TIMEZONE)
+    local = to_local_time(pd.to_datetime(df['time']), zones).dt.round('1min')
+    day = local.dt.normalize()
+    holidays = holiday_dates(day.min().year, day.max().year)
+    keep = (local.dt.hour.isin(HOURS_OF_INTEREST).values &
+            (local.dt.dayofweek < 5).values &
+            ~day.isin(holidays).values)
+    df = df.loc[keep].reset_index(drop=True)
+    df['time'] = local.values[keep]
+    df['is_morning'] = df['time'].dt.hour < MORNING_BEFORE_HOUR
+    df['slot'] = minute_slots(df['time'], SLOT_MINUTES)
+    return add_route_keys(df)
+
+
+def add_route_keys(df):
+    """Adds the home and work columns that identify the commute a sample belongs to, all
+    four address columns become categoricals over the same addresses"""
+    morning = df['is_morning'].values.astype(bool)
+    origin, destination = route_categories(df['origin'], df['destination'])
+    df['origin'], df['destination'] = origin, destination
+    df['home'] = pd.Categorical.from_codes(np.where(morning, origin.codes, destination.codes), origin.categories)
+    df['work'] = pd.Categorical.from_codes(np.where(morning, destination.codes, origin.codes), origin.categories)
     return df
 
 
@@ -55,52 +138,161 @@ def distance_conversion(dist):
     return round(clean_dist / KM_2_MILES, 1)
 
 
-def remove_weekends(df):
-    """Removes Weekends from Commute Consideration"""
-    df['is_weekday'] = df['time'].apply(lambda x: 1 if x.dayofweek < 5 else 0)
-    df = df.drop(df.loc[df['is_weekday'] == 0].index)
-    df.reset_index(drop=True, inplace=True)
-    df = df.drop(['is_weekday'], axis=1)
-    return df
+def _parse_unique(text, parser):
+    """Parses each distinct value of a text column once and broadcasts the results
+    back to every row, google's text values repeat heavily"""
+    codes, uniques = pd.factorize(text)
+    if len(uniques) == 0:
+        return pd.Series(float('nan'), index=text.index)
+    parsed = parser(pd.Series(uniques, dtype=object).astype(str)).to_numpy()
+    values = parsed.take(codes)
+    values[codes == -1] = float('nan')
+    return pd.Series(values, index=text.index)
+
 
+def _durations_in_minutes(text):
+    parts = text.str.extract(DURATION_PATTERN).astype(float)
+    minutes = parts['days'].fillna(0) * 1440 + parts['hours'].fillna(0) * 60 + parts['mins'].fillna(0)
+    return minutes.where(parts.notnull().any(axis=1))
 
-def perc_95(x):
-    return x.quantile(0.95)
 
+def _distances_in_miles(text):
+    parts = text.str.extract(DISTANCE_PATTERN)
+    value = parts['value'].str.replace(',', '', regex=False).astype(float)
+    return (value * parts['unit'].map(MILES_PER_UNIT)).round(1)
 
-def perc_5(x):
-    return x.quantile(0.05)
 
+def parse_durations(text):
+    """Vectorized duration_clean, unparseable values become NaN"""
+    return _parse_unique(text, _durations_in_minutes)
 
-def time_aggregator(df):
-    """Groups commute times by 5 minute increment and returns time stats"""
-    df['hour_min'] = df['time'].dt.time
+
+def parse_distances(text):
+    """Vectorized distance_conversion for km/mi/m/ft, unparseable values become NaN"""
+    return _parse_unique(text, _distances_in_miles)
+
+
+@instrumented()
+def clean_commute_columns(df):
+    """Parses the duration and distance text columns in bulk and drops malformed rows.
+    Returns the cleaned frame and a rejects summary with one row per column holding the
+    number of rows dropped and a few example values"""
+    durations = parse_durations(df['duration_in_traffic'])
+    distances = parse_distances(df['distance'])
+    rejects = []
+    for column, parsed in [('duration_in_traffic', durations), ('distance', distances)]:
+        bad = df.loc[parsed.isnull(), column]
+        rejects.append({'column': column, 'rejected': len(bad),
+                        'examples': bad.astype(str).unique()[:5].tolist()})
+    keep = durations.notnull() & distances.notnull()
+    df = df.loc[keep].copy()
+    df['duration_in_traffic'] = durations[keep].astype(DTYPES['duration_in_traffic'])
+    df['distance'] = distances[keep].astype(DTYPES['distance'])
+    return df.reset_index(drop=True), pd.DataFrame(rejects).set_index('column')
+
+
+def merge_rejects(total, rejects):
+    """Adds up the rejects summaries of clean_commute_columns over several chunks"""
+    if total is None:
+        return rejects
+    merged = total.copy()
+    merged['rejected'] += rejects['rejected']
+    merged['examples'] = [list(dict.fromkeys(old + new))[:5] for old, new in
+                          zip(total['examples'], rejects['examples'])]
+    return merged
+
+
+def print_rejects(rejects):
+    """Prints a one line summary per column that had malformed values"""
+    for column, row in rejects.loc[rejects['rejected'] > 0].iterrows():
+        print('Dropped {} rows with unparseable {} values, e.g. {}'.format(row['rejected'], column,
+                                                                             row['examples']))
+
+
+@instrumented()
+def time_aggregator(df, engine='exact'):
+    """Groups commute times by route and 5 minute slot and returns time stats.
+    engine='sketch' estimates the percentiles from t-digest sketches in one pass instead
+    of exact per group quantiles, and adds the SKETCH_PERCENTILES columns. Columns are
+    sorted so selecting from them stays lexsorted."""
     calculations = {'distance': 'nunique',
-                    'duration_in_traffic': ['mean', 'max', 'min', 'median', perc_95, perc_5]}
+                    'duration_in_traffic': ['mean', 'max', 'min', 'median']}
     final = []
     for num, time in enumerate(['morning', 'evening']):
         newdf = df.loc[df['is_morning'] == num]
-        assert newdf.origin.value_counts().shape[0] == 1, 'Multiple origins in data'
-        avgdf = newdf.groupby('hour_min', as_index=False).agg(calculations)
-        final.append(avgdf)
+        if engine == 'sketch':
+            avgdf = sketch_aggregate(newdf)
+        else:
+            avgdf = newdf.groupby(ROUTE_KEYS + ['slot'], as_index=False, observed=True).agg(calculations)
+            # perc_95 and perc_5 through groupby quantile instead of a python call per group
+            durations = newdf.groupby(ROUTE_KEYS + ['slot'], observed=True)['duration_in_traffic']
+            avgdf[('duration_in_traffic', 'perc_95')] = durations.quantile(0.95).values
+            avgdf[('duration_in_traffic', 'perc_5')] = durations.quantile(0.05).values
+        final.append(avgdf.sort_index(axis=1))
     return final[0], final[1]
 
 
-def merge_morning_evening_data(morning, evening):
+def sketch_aggregate(df, percentiles=SKETCH_PERCENTILES):
+    """time_aggregator's table for one direction with percentiles estimated from a
+    t-digest per route and departure time"""
+    keys = ROUTE_KEYS + ['slot']
+    if len(df):
+        codes, groups = pd.factorize(pd.MultiIndex.from_frame(df[keys]), sort=True)
+        table = groups.to_frame(index=False)
+    else:
+        # factorize cannot tell the levels of an empty index
+        codes, table = np.zeros(0, dtype='int64'), df[keys].reset_index(drop=True)
+    digests = group_digests(codes, df['duration_in_traffic'].values)
+    table.columns = [(key, '') for key in keys]
+    table[('distance', 'nunique')] = df.groupby(codes)['distance'].nunique().values
+    quantiles = [('median', 0.5), ('perc_95', 0.95), ('perc_5', 0.05)]
+    quantiles += [('perc_{}'.format(p), p / 100) for p in percentiles]
+    table[('duration_in_traffic', 'mean')] = [(d.means * d.weights).sum() / d.count for d in digests]
+    table[('duration_in_traffic', 'max')] = [d.max for d in digests]
+    table[('duration_in_traffic', 'min')] = [d.min for d in digests]
+    for name, q in quantiles:
+        table[('duration_in_traffic', name)] = [d.quantile(q) for d in digests]
+    table.columns = pd.MultiIndex.from_tuples(table.columns)
+    return table
+
+
+@instrumented()
+def daily_averages(df):
+    """Average commute time for each route, date and direction, read from the rollups of
+    the samples; per week or month instead for histories too long to plot daily (see
+    rollups.timeline)"""
+    return timeline(build_rollups(df))
+
+
+@instrumented()
+def distance_variation(df):
+    """Average route miles and number of distinct routes per departure time, returns
+    [evening, morning] frames indexed by home, work and slot"""
+    frames = []
+    for i in range(2):
+        commute = df.loc[df['is_morning'] == i]
+        commute = commute.groupby(ROUTE_KEYS + ['slot'], observed=True)['distance'].agg(['mean', 'nunique'])
+        frames.append(commute.rename(columns={'nunique': 'num_commutes'}))
+    return frames
+
+
+@instrumented()
+def merge_morning_evening_data(morning, evening, spread=PLOT_SPREAD_MINUTES):
     """Merges morning and evening data, returns the merged data set, and plots
-    the 95% intervals for total commute time given departure times at 8 hour spreads"""
-    morning['merge'] = morning['hour_min'].astype(str).str[:5].str.replace(':', '.').astype(float) + 8
-    evening['merge'] = evening['hour_min'].astype(str).str[:5].str.replace(':', '.').astype(float)
-    merged = pd.merge(morning, evening, on='merge')
+    the 95% intervals for total commute time given departure times 'spread' minutes apart"""
+    merged = pd.merge(morning.assign(merge=morning['slot'] + spread), evening.assign(merge=evening['slot']),
+                      on=ROUTE_KEYS + ['merge'])
     merged['total_avg'] = merged['duration_in_traffic_x']['mean'] + merged['duration_in_traffic_y']['mean']
     merged['total_95'] = merged['duration_in_traffic_x']['perc_95'] + merged['duration_in_traffic_y']['perc_95']
     merged['total_5'] = merged['duration_in_traffic_x']['perc_5'] + merged['duration_in_traffic_y']['perc_5']
     merged['total_median'] = merged['duration_in_traffic_x']['median'] + merged['duration_in_traffic_y']['median']
-    merged['xlabels'] = merged['hour_min_x'].astype(str).str[:-3] + '-' + merged['hour_min_y'].astype(str).str[:-3]
+    merged['xlabels'] = [morning_slot + '-' + evening_slot for morning_slot, evening_slot in
+                         zip(slot_labels(merged['slot_x']), slot_labels(merged['slot_y']))]
     return merged
 
 
-def print_statistics(merged, morning, evening, metric='mean'):
+@instrumented()
+def print_statistics(windows, morning, evening, metric='mean'):
     # Best/Worst Times
     worst_morn = morning.loc[morning['duration_in_traffic'][metric] == morning['duration_in_traffic'][metric].max()]
     best_morn = morning.loc[morning['duration_in_traffic'][metric] == morning['duration_in_traffic'][metric].min()]
@@ -108,31 +300,191 @@ def print_statistics(merged, morning, evening, metric='mean'):
     best_evening = evening.loc[evening['duration_in_traffic'][metric] == evening['duration_in_traffic'][metric].min()]
     print('**BEST & WORST AVERAGE DEPARTURE TIMES [DEPARTURE] [MINUTES]**')
     print('**MORNING**')
-    print('Best: ', best_morn['hour_min'].tolist(), best_morn['duration_in_traffic'][metric].tolist())
-    print('Worst: ', worst_morn['hour_min'].tolist(), worst_morn['duration_in_traffic'][metric].tolist())
+    print('Best: ', slot_labels(best_morn['slot']), best_morn['duration_in_traffic'][metric].tolist())
+    print('Worst: ', slot_labels(worst_morn['slot']), worst_morn['duration_in_traffic'][metric].tolist())
     print('**EVENING**')
-    print('Best: ', best_evening['hour_min'].tolist(), best_evening['duration_in_traffic'][metric].tolist())
-    print('Worst: ', worst_evening['hour_min'].tolist(), worst_evening['duration_in_traffic'][metric].tolist())
-    print('\n**BEST 8 HOUR INTERVAL DEPARTURES**')
-    median_min = merged.loc[merged['total_median'] == merged['total_median'].min()]
-    avg_min = merged.loc[merged['total_avg'] == merged['total_avg'].min()]
-    print('Minimum Time (Median): ', median_min['xlabels'].tolist(), median_min['total_median'].tolist())
-    print('Minimum Time (Avg): ', median_min['xlabels'].tolist(), median_min['total_avg'].tolist())
-
-
-def main():
-    df = time_date_adjustments()
-    df['duration_in_traffic'] = df['duration_in_traffic'].apply(duration_clean)
-    df['distance'] = df['distance'].apply(distance_conversion)
-    df = remove_weekends(df)
-    evening, morning = time_aggregator(df)
-    merged = merge_morning_evening_data(morning, evening)
-    mean_commute_time_plot(morning, evening)
-    daily_commute_time_plot(df)
-    commute_distance_variation_plot(df)
-    total_commute_minutes_plot(merged)
-    lost_time_plot(merged)
-    print_statistics(merged, morning, evening)
+    print('Best: ', slot_labels(best_evening['slot']), best_evening['duration_in_traffic'][metric].tolist())
+    print('Worst: ', slot_labels(worst_evening['slot']), worst_evening['duration_in_traffic'][metric].tolist())
+    print('\n**BEST DEPARTURE WINDOWS [LEAVE HOME-LEAVE WORK] [MINUTES ON SITE] [TOTAL MINUTES]**')
+    for window in windows.itertuples():
+        print('{}. {}-{}  {:.0f}  {:.1f}'.format(window.rank, window.leave_home, window.leave_work,
+                                                window.on_site_minutes, window.total))
+    median = departure_windows(morning, evening, metric='median', k=1)
+    if len(median):
+        print('Minimum Time (Median): ', median['leave_home'][0] + '-' + median['leave_work'][0],
+              median['total'][0])
+
+
+def split_by_route(table):
+    """{(home, work): rows} for a table with home/work columns or index levels"""
+    if isinstance(table.index, pd.MultiIndex):
+        return {route: rows.droplevel(ROUTE_KEYS) for route, rows in table.groupby(level=ROUTE_KEYS, observed=True)}
+    keys = [(key, '') for key in ROUTE_KEYS] if table.columns.nlevels > 1 else ROUTE_KEYS
+    return {route: rows.reset_index(drop=True) for route, rows in table.groupby(keys, observed=True)}
+
+
+def empty_route(table):
+    """The rows split_by_route would give a route 'table' has none of"""
+    if isinstance(table.index, pd.MultiIndex):
+        return table.iloc[:0].droplevel(ROUTE_KEYS)
+    return table.iloc[:0].reset_index(drop=True)
+
+
+def route_tables(evening, morning, daily, distances):
+    """Splits multi-route tables into {(home, work): tables} with the merged morning and
+    evening data and best departure windows of each route, the form produce_outputs and
+    route_summary take. A route sampled in one direction only gets empty tables for the
+    other, and so empty merged data and windows."""
+    whole = [evening, morning, daily] + list(distances)
+    parts = [split_by_route(table) for table in whole]
+    tables = {}
+    for route in sorted(set(parts[0]) | set(parts[1])):
+        route_evening, route_morning, route_daily, *route_distances = [
+            part[route] if route in part else empty_route(table) for part, table in zip(parts, whole)]
+        tables[route] = {'evening': route_evening, 'morning': route_morning,
+                         'merged': merge_morning_evening_data(route_morning, route_evening),
+                         'windows': departure_windows(route_morning, route_evening),
+                         'daily': route_daily, 'distances': route_distances}
+    return tables
+
+
+def analyze_route(df, engine='exact'):
+    """Every table for the cleaned, weekday samples of one or more routes"""
+    evening, morning = time_aggregator(df, engine)
+    return route_tables(evening, morning, daily_averages(df), distance_variation(df))
+
+
+@instrumented()
+def analyze_routes(df, processes=None, engine='exact'):
+    """Analyzes each route, fanning the routes out over a process pool when there is more
+    than one. Returns {(home, work): tables} and the cross route summary"""
+    groups = [group for _, group in df.groupby(ROUTE_KEYS, sort=True, observed=True)]
+    if processes == 1 or len(groups) < 2:
+        results = [analyze_route(df, engine)]
+    else:
+        groups = [used_categories(group) for group in groups]
+        workers = processes or os.cpu_count()
+        with ProcessPoolExecutor(workers) as pool:
+            chunksize = max(1, len(groups) // (workers * 4))
+            results = list(pool.map(analyze_route, groups, repeat(engine), chunksize=chunksize))
+    tables = {route: result for part in results for route, result in part.items()}
+    return tables, route_summary(tables)
+
+
+def route_summary(tables, metric='mean'):
+    """One row per route with its best morning and evening departures and best departure
+    window for the allowed time on site (see optimizer.departure_windows)"""
+    rows = []
+    for (home, work), route in sorted(tables.items()):
+        row = {'home': home, 'work': work}
+        for name in ['morning', 'evening']:
+            durations = route[name]['duration_in_traffic'][metric]
+            if durations.empty:
+                continue
+            best = durations.idxmin()
+            row['best_' + name] = slot_labels([route[name]['slot'][best]])[0]
+            row['best_{}_{}'.format(name, metric)] = durations[best]
+        windows = departure_windows(route['morning'], route['evening'], metric=metric, k=1)
+        if len(windows):
+            row['best_window'] = windows['leave_home'][0] + '-' + windows['leave_work'][0]
+            row['window_on_site'] = windows['on_site_minutes'][0]
+            row['window_' + metric] = windows['total'][0]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _flat_slots(table, direction, weekday):
+    """One direction of time_aggregator's table with flat columns and 'HH:MM' slots"""
+    flat = table['duration_in_traffic'].copy()
+    flat.insert(0, 'hour_min', slot_labels(table['slot']))
+    for num, key in enumerate(ROUTE_KEYS):
+        flat.insert(num, key, table[key].astype(str).values)
+    return flat.assign(weekday=weekday, direction=direction)
+
+
+@instrumented()
+def build_aggregates(df, engine='exact'):
+    """Slot statistics and best departure windows per route, weekday ('all' for every
+    weekday) and direction, the tables query_service.py serves. Without samples both
+    are empty."""
+    slots, windows = [], []
+    weekday = df['time'].dt.dayofweek
+    days = [('all', df)] + [(day, df.loc[weekday == num]) for num, day in enumerate(WEEKDAYS)]
+    for day, rows in days:
+        # 'all' is aggregated even when empty so the tables always have their columns
+        if not len(rows) and day != 'all':
+            continue
+        evening, morning = time_aggregator(rows, engine)
+        slots += [_flat_slots(morning, 'morning', day), _flat_slots(evening, 'evening', day)]
+        windows.append(departure_windows(morning, evening).assign(weekday=day))
+    return {'slots': pd.concat(slots, ignore_index=True), 'windows': pd.concat(windows, ignore_index=True)}
+
+
+def write_aggregates(aggregates, path=AGGREGATES_PATH):
+    """Writes the aggregates atomically so a running query service never reads a partial file"""
+    tmp = path + '.tmp'
+    pd.to_pickle(aggregates, tmp)
+    os.replace(tmp, path)
+
+
+def produce_outputs(route, tables):
+    """Writes the html figures and prints statistics for one route's tables, file names
+    are prefixed with 'route' when given"""
+    from plots import (mean_commute_time_plot, daily_commute_time_plot, lost_time_plot,
+                       commute_distance_variation_plot, total_commute_minutes_plot)
+    prefix = '' if route is None else route
+    mean_commute_time_plot(tables['morning'], tables['evening'], filename_prefix=prefix)
+    daily_commute_time_plot(tables['daily'], filename_prefix=prefix)
+    commute_distance_variation_plot(tables['distances'], filename_prefix=prefix)
+    total_commute_minutes_plot(tables['merged'], filename_prefix=prefix)
+    lost_time_plot(tables['merged'], filename_prefix=prefix)
+    print_statistics(tables['windows'], tables['morning'], tables['evening'])
+
+
+def write_outputs(tables, summary, dashboard_path=None, dashboard_mode='inline', figures=True):
+    """Plots and statistics for every route, followed by the cross route summary when
+    there is more than one route. With dashboard_path all figures go into that one
+    file (see dashboard.write_dashboard) instead of one html file each. With
+    figures=False only the statistics are printed"""
+    if figures and dashboard_path:
+        from dashboard import write_dashboard
+        write_dashboard(tables, dashboard_path, mode=dashboard_mode)
+    for num, ((home, work), route) in enumerate(sorted(tables.items())):
+        if len(tables) > 1:
+            print('\n**ROUTE {}: {} <-> {}**'.format(num + 1, home, work))
+        if figures and not dashboard_path:
+            produce_outputs('route{}_'.format(num + 1) if len(tables) > 1 else None, route)
+        else:
+            print_statistics(route['windows'], route['morning'], route['evening'])
+    if len(tables) > 1:
+        print('\n**ALL ROUTES**')
+        print(summary.to_string(index=False))
+
+
+def analyze_source(source='./commute_info.csv', processes=None, engine='exact', chunksize=None):
+    """Loads, cleans and analyzes the samples of a CSV or store directory. Returns
+    {(home, work): tables}, the cross route summary and the cleaned samples. With
+    chunksize the samples are streamed through incremental.stream_tables that many rows
+    at a time instead of loaded at once, and no samples are returned"""
+    if not chunksize:
+        df, rejects = clean_commute_columns(time_date_adjustments(source))
+        print_rejects(rejects)
+        tables, summary = analyze_routes(df, processes=processes, engine=engine)
+        return tables, summary, df
+    # incremental builds on this module, so it is only imported when streaming
+    from incremental import stream_tables
+    tables = route_tables(*stream_tables(source, chunksize, engine))
+    return tables, route_summary(tables), None
+
+
+def main(argv=None):
+    """The command line of cli.py, running 'plots' when no command is given"""
+    # cli builds on this module, so it is only imported here
+    from cli import main as cli_main
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0].startswith('-'):
+        argv = ['plots'] + argv
+    cli_main(argv)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+"""Writes every figure of every route into one dashboard instead of one html file (each
+with its own copy of plotly.js) per figure. Figures are built in parallel, long series
+are drawn with WebGL and dense series are downsampled with LTTB to a point budget."""
+
+import os
+import html
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import plotly.offline as offline
+import plots
+from profiling import instrumented
+
+MAX_POINTS = 2000
+# Scatter traces longer than this are drawn with Scattergl
+WEBGL_THRESHOLD = 1000
+PLOTLY_JS = 'plotly.min.js'
+CONFIG = dict(modeBarButtonsToRemove=['sendDataToCloud'], showLink=False, displayModeBar=False)
+TITLES = {'mean_commute_time_plot': 'Commute Times by Departure',
+          'daily_commute_time_plot': 'Daily Commute Times',
+          'commute_distance_variation_plot': 'Route Variation',
+          'total_commute_minutes_plot': 'Total Commute Minutes',
+          'lost_time_plot': 'Time Lost'}
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets: indices of 'threshold' points of the numeric
+    series x, y that keep its visual shape"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    # bucket i spans [edges[i], edges[i + 1]), the first and last points are always kept
+    edges = (np.arange(threshold - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _numeric(values):
+    """Numbers LTTB can measure areas with, positions when x is categorical"""
+    values = pd.Series(list(values))
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+    try:
+        return pd.to_datetime(values).astype('int64').to_numpy(dtype=float)
+    except (ValueError, TypeError):
+        return np.arange(len(values), dtype=float)
+
+
+def optimize_trace(trace, max_points=MAX_POINTS, webgl_threshold=WEBGL_THRESHOLD):
+    """Downsamples a long scatter trace (a plain dict) and switches it to WebGL"""
+    if trace.get('type', 'scatter') != 'scatter' or trace.get('x') is None:
+        return trace
+    x, y = list(trace['x']), np.asarray(trace['y'], dtype=float)
+    if len(x) > max_points:
+        present = np.flatnonzero(~np.isnan(y))
+        keep = present[lttb(_numeric([x[i] for i in present]), y[present], max_points)]
+        trace['x'], trace['y'] = [x[i] for i in keep], y[keep]
+    if len(x) > webgl_threshold:
+        trace['type'] = 'scattergl'
+    return trace
+
+
+def render(plot_name, args, max_points=MAX_POINTS):
+    """Builds one figure and returns it as an html div without plotly.js"""
+    figure, _ = getattr(plots, plot_name).build(*args)
+    figure = figure.to_dict()
+    figure['data'] = [optimize_trace(trace, max_points) for trace in figure['data']]
+    return offline.plot(figure, validate=False, output_type='div', include_plotlyjs=False, config=CONFIG)
+
+
+def figure_tasks(tables):
+    """(section title, plot name, arguments) for every figure of every route"""
+    tasks = []
+    for (home, work), route in sorted(tables.items()):
+        section = None
+        if len(tables) > 1:
+            section = '{} &harr; {}'.format(html.escape(str(home)), html.escape(str(work)))
+        tasks += [(section, 'mean_commute_time_plot', (route['morning'].copy(), route['evening'].copy())),
+                  (section, 'daily_commute_time_plot', (route['daily'],)),
+                  (section, 'commute_distance_variation_plot', (route['distances'],)),
+                  (section, 'total_commute_minutes_plot', (route['merged'],)),
+                  (section, 'lost_time_plot', (route['merged'].copy(),))]
+    return tasks
+
+
+@instrumented()
+def write_dashboard(tables, path='./dashboard.html', mode='inline', max_points=MAX_POINTS, processes=None):
+    """Writes all figures to one html file. mode='inline' embeds plotly.js once in the
+    file, mode='directory' writes it once as a shared plotly.min.js next to the file."""
+    tasks = figure_tasks(tables)
+    with ProcessPoolExecutor(processes) as pool:
+        divs = list(pool.map(render, [task[1] for task in tasks], [task[2] for task in tasks],
+                             [max_points] * len(tasks)))
+    directory = os.path.dirname(os.path.abspath(path))
+    if mode == 'directory':
+        with open(os.path.join(directory, PLOTLY_JS), 'w') as f:
+            f.write(offline.get_plotlyjs())
+        script = '<script src="{}"></script>'.format(PLOTLY_JS)
+    else:
+        script = '<script type="text/javascript">{}</script>'.format(offline.get_plotlyjs())
+    body, section = [], None
+    for (task_section, plot_name, _), div in zip(tasks, divs):
+        if task_section != section and task_section is not None:
+            body.append('<h1>{}</h1>'.format(task_section))
+        section = task_section
+        body.append('<h2>{}</h2>\n{}'.format(TITLES[plot_name], div))
+    with open(path, 'w') as f:
+        f.write('<html><head><meta charset="utf-8" />{}</head><body>\n{}\n</body></html>'.format(
+            script, '\n'.join(body)))
+    print('Wrote {} figures to {}'.format(len(divs), path))
@@ -0,0 +1,217 @@
+"""Incremental version of the analysis (cli.py plots). Keeps mergeable per-slot state
+between runs so each run only parses and folds in the samples collected since the last
+one.
+
+The state holds, per route, direction and 5 minute departure slot, a histogram of the
+whole minute durations google reports (from which counts, sums, min/max and quantiles
+all follow), the distinct route distances, and the calendar rollups (see rollups.py) the
+daily plot reads. States saved before the rollups existed are rebuilt from scratch.
+Because durations are whole minutes the histogram is lossless: the median, perc_5 and
+perc_95 columns match a full recompute exactly and the means up to float rounding
+(< 1e-9 minutes). A high-water mark is kept per route (origin and destination), the time
+of its newest sample folded so far. Samples at or before their route's mark are assumed
+to have been seen already, so a route written (or read) behind the others is still picked
+up, but late back-filled rows need a full rebuild.
+
+A state for engine='sketch' also keeps a t-digest per route, direction and slot (see
+sketches.py), merged with the digests of every chunk, and reports its percentiles,
+SKETCH_PERCENTILES included, like time_aggregator's sketch engine does.
+
+Samples are read and folded CHUNKSIZE rows (or one store partition) at a time, so memory
+depends on the chunk size and the number of groups rather than the length of the
+history; stream_tables uses this to analyze files too large to load at once."""
+
+import os
+import numpy as np
+import pandas as pd
+from schema import DTYPES
+import rollups
+from sketches import group_digests
+from commute_analyzer import (ROUTE_KEYS, CHUNKSIZE, SKETCH_PERCENTILES, load_sample_chunks, adjust_samples,
+                              clean_commute_columns, merge_rejects, print_rejects, route_tables,
+                              route_summary, write_outputs)
+
+STATE_PATH = './commute_state.pkl'
+BUCKET = ROUTE_KEYS + ['is_morning', 'slot']
+QUANTILES = {'median': 0.5, 'perc_95': 0.95, 'perc_5': 0.05}
+
+
+def empty_state(engine='exact'):
+    state = {'high_waters': pd.Series(dtype='datetime64[ns]'),
+             'durations': pd.Series(dtype='int64'),
+             'distances': pd.Series(dtype='int64'),
+             'rollups': rollups.empty_rollups()}
+    if engine == 'sketch':
+        state['digests'] = {}
+    return state
+
+
+def load_state(state_path=STATE_PATH, engine='exact'):
+    if os.path.exists(state_path):
+        state = pd.read_pickle(state_path)
+        if 'rollups' not in state:
+            print('{} has no rollups yet, rebuilding it'.format(state_path))
+        elif 'high_waters' not in state:
+            print('{} has no per route high-water marks yet, rebuilding it'.format(state_path))
+        elif engine == 'sketch' and 'digests' not in state:
+            print('{} has no digests yet, rebuilding it'.format(state_path))
+        else:
+            return state
+    return empty_state(engine)
+
+
+def save_state(state, state_path=STATE_PATH):
+    tmp = state_path + '.tmp'
+    pd.to_pickle(state, tmp)
+    os.replace(tmp, state_path)
+
+
+def _add(total, new):
+    """Adds two count series/frames aligned on their index"""
+    if len(total) == 0:
+        return new
+    return total.add(new, fill_value=0).astype('int64')
+
+
+def fold(state, df):
+    """Folds cleaned samples (as passed to time_aggregator) into the state"""
+    if df.empty:
+        return state
+    # The state keeps the key types it has always had (address strings, 0/1 flags, int
+    # slots, dates) so states saved by earlier versions still align
+    home, work = df['home'].astype(object), df['work'].astype(object)
+    keys = [home, work, df['is_morning'].astype('int64'), df['slot'].astype('int64')]
+    durations = df['duration_in_traffic'].astype('int64')
+    # float32 miles widened back to the parser's 0.1 mile values
+    distances = df['distance'].astype('float64').round(1)
+    state['durations'] = _add(state['durations'], df.groupby(keys + [durations]).size())
+    state['distances'] = _add(state['distances'], df.groupby(keys + [distances]).size())
+    state['rollups'] = rollups.fold(state['rollups'], df)
+    if 'digests' in state:
+        state['digests'] = fold_digests(state['digests'], keys, durations)
+    return state
+
+
+def fold_digests(digests, keys, durations):
+    """Merges a digest per key of the new samples into 'digests'"""
+    codes, groups = pd.factorize(pd.MultiIndex.from_arrays(keys))
+    for key, digest in zip(groups, group_digests(codes, durations.values)):
+        digests[key] = digests[key].merge(digest) if key in digests else digest
+    return digests
+
+
+def _unseen(raw, high_waters):
+    """Whether each sample is newer than the high-water mark of its route"""
+    if len(high_waters) == 0:
+        return pd.Series(True, index=raw.index)
+    marks = high_waters.reindex(pd.MultiIndex.from_arrays([raw['origin'], raw['destination']]))
+    return pd.Series(marks.isna().values | (raw['time'].values > marks.values), index=raw.index)
+
+
+def update_state(state, csv_loc='./commute_info.csv', chunksize=CHUNKSIZE):
+    """Loads, cleans and folds every sample newer than its route's high-water mark, a
+    chunk at a time"""
+    high_waters, rows, rejects = state['high_waters'], 0, None
+    start = high_waters.min() if len(high_waters) else None
+    for raw in load_sample_chunks(csv_loc, chunksize, start=start):
+        raw['time'] = pd.to_datetime(raw['time'])
+        raw = raw.loc[_unseen(raw, high_waters)]
+        if raw.empty:
+            continue
+        newest = raw.groupby(['origin', 'destination'])['time'].max()
+        if len(state['high_waters']):
+            newest = pd.concat([state['high_waters'], newest]).groupby(level=[0, 1]).max()
+        state['high_waters'] = newest
+        df, chunk_rejects = clean_commute_columns(adjust_samples(raw.reset_index(drop=True)))
+        rejects = merge_rejects(rejects, chunk_rejects)
+        state = fold(state, df)
+        rows += len(raw)
+    if rejects is not None:
+        print_rejects(rejects)
+    return state, rows
+
+
+def _histogram_quantiles(hist, q):
+    """pandas' linear interpolation quantile of every bucket in a sorted histogram series"""
+    ends = hist.to_numpy().cumsum()
+    grouped = hist.groupby(level=BUCKET, sort=False)
+    sizes = grouped.sum()
+    starts = ends[grouped.size().to_numpy().cumsum() - 1] - sizes.to_numpy()
+    position = (sizes.to_numpy() - 1) * q
+    lower, upper = np.floor(position), np.ceil(position)
+    values = hist.index.get_level_values('duration_in_traffic').to_numpy().astype(float)
+    low = values[np.searchsorted(ends, starts + lower, side='right')]
+    high = values[np.searchsorted(ends, starts + upper, side='right')]
+    return pd.Series(low + (high - low) * (position - lower), index=sizes.index)
+
+
+def slot_stats(state):
+    """Per route, direction and slot duration statistics named like time_aggregator's"""
+    quantiles = QUANTILES
+    if 'digests' in state:
+        quantiles = dict(QUANTILES, **{'perc_{}'.format(p): p / 100 for p in SKETCH_PERCENTILES})
+    if len(state['durations']) == 0:
+        # No samples (or none on a weekday) folded yet
+        index = pd.MultiIndex.from_arrays([[]] * len(BUCKET), names=BUCKET)
+        columns = ['count', 'mean', 'max', 'min'] + list(quantiles) + ['nunique', 'mean_distance']
+        return pd.DataFrame(columns=columns, index=index, dtype='float64')
+    hist = state['durations'].sort_index()
+    durations = hist.index.get_level_values('duration_in_traffic')
+    grouped = hist.groupby(level=BUCKET)
+    stats = pd.DataFrame({'count': grouped.sum(),
+                          'mean': (hist * durations).groupby(level=BUCKET).sum() / grouped.sum(),
+                          'max': pd.Series(durations, index=hist.index).groupby(level=BUCKET).max(),
+                          'min': pd.Series(durations, index=hist.index).groupby(level=BUCKET).min()})
+    if 'digests' in state:
+        digests = [state['digests'][key] for key in stats.index]
+        for name, q in quantiles.items():
+            stats[name] = [digest.quantile(q) for digest in digests]
+    else:
+        for name, q in quantiles.items():
+            stats[name] = _histogram_quantiles(hist, q)
+    miles = state['distances'].index.get_level_values('distance')
+    distances = state['distances'].groupby(level=BUCKET)
+    stats['nunique'] = distances.size()
+    stats['mean_distance'] = (state['distances'] * miles).groupby(level=BUCKET).sum() / distances.sum()
+    return stats
+
+
+def state_tables(state):
+    """Rebuilds the evening, morning, daily and distance tables that time_aggregator,
+    daily_averages and distance_variation produce from a full recompute"""
+    stats = slot_stats(state).reset_index()
+    columns = ['mean', 'max', 'min', 'median'] + [column for column in stats if column.startswith('perc_')]
+    aggregated, distances = [], []
+    for num in range(2):
+        part = stats.loc[stats['is_morning'] == num].sort_values(ROUTE_KEYS + ['slot'])
+        slot = part['slot'].astype(DTYPES['slot']).values
+        table = pd.DataFrame({(key, ''): part[key].values for key in ROUTE_KEYS})
+        table[('slot', '')] = slot
+        table[('distance', 'nunique')] = part['nunique'].values
+        for column in columns:
+            table[('duration_in_traffic', column)] = part[column].values
+        table.columns = pd.MultiIndex.from_tuples(table.columns)
+        aggregated.append(table.sort_index(axis=1))
+        index = pd.MultiIndex.from_arrays([part['home'], part['work'], slot], names=ROUTE_KEYS + ['slot'])
+        distances.append(pd.DataFrame({'mean': part['mean_distance'].values,
+                                       'num_commutes': part['nunique'].values}, index=index))
+    return aggregated[0], aggregated[1], rollups.timeline(state['rollups']), distances
+
+
+def stream_tables(csv_loc='./commute_info.csv', chunksize=CHUNKSIZE, engine='exact'):
+    """The tables time_aggregator, daily_averages and distance_variation produce for the
+    whole file, without ever holding more than a chunk of it in memory"""
+    state, _ = update_state(empty_state(engine), csv_loc, chunksize)
+    return state_tables(state)
+
+
+def main(csv_loc='./commute_info.csv', state_path=STATE_PATH, engine='exact'):
+    state, rows = update_state(load_state(state_path, engine), csv_loc)
+    save_state(state, state_path)
+    print('Folded {} new samples, newest {}'.format(rows, state['high_waters'].max()))
+    tables = route_tables(*state_tables(state))
+    write_outputs(tables, route_summary(tables))
+
+
+if __name__ == '__main__':
+    main()
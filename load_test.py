@@ -0,0 +1,119 @@
+"""Load test for query_service.py, reports request latency percentiles and throughput.
+
+Starts the service in process on the given aggregates (built from synthetic samples
+when the file does not exist) unless --url points at a running one, then sends a mix of
+/best, /slot and /windows queries from concurrent keep-alive connections. A share of the
+queries repeat, like dashboards refreshing the same views do.
+Run with 'python load_test.py [--url URL] [--requests N] [--concurrency C]'."""
+
+import os
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+import numpy as np
+from query_service import AGGREGATES_PATH, QueryService, make_server
+
+REQUESTS = 20000
+CONCURRENCY = 8
+# Distinct queries to draw from, drawn with a Zipf like skew
+DISTINCT_QUERIES = 2000
+WEEKDAYS = ['all', 'mon', 'tue', 'wed', 'thu', 'fri']
+
+
+def synthetic_aggregates(path, routes=20, days=60):
+    """Writes aggregates for generated samples, see synthetic_data.py"""
+    from synthetic_data import generate_samples
+    from commute_analyzer import adjust_samples, clean_commute_columns, build_aggregates, write_aggregates
+    df, _ = clean_commute_columns(adjust_samples(generate_samples(routes=routes, days=days)))
+    write_aggregates(build_aggregates(df), path)
+    print('Wrote synthetic aggregates for {} routes to {}'.format(routes, path))
+
+
+def get(connection, target):
+    connection.request('GET', target)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def make_queries(url, distinct=DISTINCT_QUERIES, seed=0):
+    """Paths of 'distinct' random queries over the service's routes"""
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    routes = [route['route'] for route in json.loads(get(connection, '/routes')[1])]
+    connection.close()
+    rng = np.random.RandomState(seed)
+    queries = []
+    for _ in range(distinct):
+        params = {'route': routes[rng.randint(len(routes))], 'weekday': WEEKDAYS[rng.randint(len(WEEKDAYS))]}
+        endpoint = ['/best', '/slot', '/windows'][rng.randint(3)]
+        if endpoint != '/windows':
+            params['direction'] = 'morning' if rng.rand() < 0.5 else 'evening'
+        if endpoint == '/best':
+            params['metric'] = ['mean', 'median', 'perc_95'][rng.randint(3)]
+        if endpoint == '/slot':
+            hour = rng.randint(6, 10) if params['direction'] == 'morning' else rng.randint(15, 19)
+            params['time'] = '{:02d}:{:02d}'.format(hour, rng.randint(60))
+        queries.append('{}?{}'.format(endpoint, urlencode(params)))
+    return queries
+
+
+def run(url, requests=REQUESTS, concurrency=CONCURRENCY, seed=0):
+    """Sends 'requests' queries over 'concurrency' connections, returns latencies in
+    seconds, the number of non-200 responses and the elapsed seconds"""
+    queries = make_queries(url, seed=seed)
+    rng = np.random.RandomState(seed + 1)
+    order = np.minimum(rng.zipf(1.2, requests), len(queries)) - 1
+    parts = urlsplit(url)
+    latencies = np.empty(requests)
+    errors = [0] * concurrency
+
+    def worker(num):
+        connection = http.client.HTTPConnection(parts.hostname, parts.port)
+        for i in range(num, requests, concurrency):
+            start = time.perf_counter()
+            status, _ = get(connection, queries[order[i]])
+            latencies[i] = time.perf_counter() - start
+            errors[num] += status != 200
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(num,)) for num in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), time.perf_counter() - start
+
+
+def report(latencies, errors, elapsed):
+    ms = latencies * 1000
+    print('{:,} requests in {:.2f}s ({:,.0f}/s), {} errors'.format(len(ms), elapsed, len(ms) / elapsed, errors))
+    print('latency ms: p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}'.format(
+        *np.percentile(ms, [50, 90, 99]), ms.max()))
+
+
+def main(url=None, path=AGGREGATES_PATH, requests=REQUESTS, concurrency=CONCURRENCY):
+    server = None
+    if url is None:
+        if not os.path.exists(path):
+            synthetic_aggregates(path)
+        server = make_server(QueryService(path), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://{}:{}'.format(*server.server_address)
+    report(*run(url, requests, concurrency))
+    if server is not None:
+        print('cache', server.service.query('/health', {}).decode('utf-8'))
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='a running query_service.py, started in process otherwise')
+    parser.add_argument('--aggregates', default=AGGREGATES_PATH)
+    parser.add_argument('--requests', type=int, default=REQUESTS)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    args = parser.parse_args()
+    main(args.url, args.aggregates, args.requests, args.concurrency)
@@ -0,0 +1,422 @@
+"""Quota aware access to the Distance Matrix API for trip_duration_retriever.py and
+collector_daemon.py.
+
+Answers are cached in memory per (origin, destination, departure time bucket) so routes
+repeated across batches, schedules or ticks of the same bucket are served locally by a
+long running client; the cache is not shared between processes. Requests pass
+a token bucket (QPS) and a daily element quota (Google bills per origin x destination
+element) and are retried with exponential backoff. stand_in_server.py serves fake
+responses to point 'url' at for testing."""
+
+import os
+import json
+import time
+import random
+import datetime
+import threading
+import contextlib
+import collections
+import requests
+from requests.adapters import HTTPAdapter
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock, runs then only share the saved count
+    fcntl = None
+
+DISTANCE_MATRIX_URL = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+# Per request limits of the Distance Matrix API
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+COLUMNS = ['distance', 'duration_in_traffic', 'destination', 'origin', 'time']
+# Seconds a cached answer is served for, and the departure time buckets answers are keyed by
+CACHE_TTL = 600
+DEPARTURE_BUCKET = 300
+QPS = 10.0
+BURST = 10
+# Elements per day
+DAILY_QUOTA = 10000
+# Elements for route pairs nobody asked for that a batch may include, requests are
+# billed per element so the client only batches routes that share destinations
+MAX_WASTE = 0
+MAX_RETRIES = 4
+# The n-th retry waits BACKOFF_SECONDS * BACKOFF_BASE ** n, up to twice that with jitter
+BACKOFF_SECONDS = 1.0
+BACKOFF_BASE = 2.0
+RETRY_STATUSES = {'OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT', 'UNKNOWN_ERROR'}
+# Requests whose HTTP latency the percentiles of metrics_summary cover
+LATENCY_WINDOW = 1000
+
+_SESSION = None
+
+
+class QuotaExceeded(Exception):
+    """The daily element quota does not cover a request"""
+
+
+def get_session(pool_size=10):
+    """Returns one shared keep-alive session so repeated calls reuse their connections"""
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _SESSION.mount('https://', adapter)
+        _SESSION.mount('http://', adapter)
+    return _SESSION
+
+
+def percentile(values, q):
+    """Nearest rank percentile of a list of numbers, None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def route_batches(routes, max_waste=None):
+    """Packs (origin, destination) routes into as few Distance Matrix requests as
+    the origin, destination and element limits allow. Returns a list of
+    (origins, destinations) tuples; every route falls inside at least one batch.
+    With max_waste a batch holds at most that many elements that are not routes."""
+    by_origin = {}
+    for origin, destination in routes:
+        dests = by_origin.setdefault(origin, [])
+        if destination not in dests:
+            dests.append(destination)
+    # An origin with too many destinations is split across several requests
+    groups = []
+    for origin, dests in by_origin.items():
+        step = min(MAX_DESTINATIONS, MAX_ELEMENTS)
+        for ind in range(0, len(dests), step):
+            groups.append((origin, dests[ind:ind + step]))
+    groups.sort(key=lambda group: len(group[1]), reverse=True)
+
+    batches = []
+    counts = []
+    for origin, dests in groups:
+        for num, (origins, destinations) in enumerate(batches):
+            merged = destinations + [d for d in dests if d not in destinations]
+            elements = (len(origins) + 1) * len(merged)
+            fits = (origin not in origins and
+                    len(origins) < MAX_ORIGINS and
+                    len(merged) <= MAX_DESTINATIONS and
+                    elements <= MAX_ELEMENTS and
+                    (max_waste is None or elements - counts[num] - len(dests) <= max_waste))
+            if fits:
+                origins.append(origin)
+                destinations[:] = merged
+                counts[num] += len(dests)
+                break
+        else:
+            batches.append(([origin], list(dests)))
+            counts.append(len(dests))
+    return batches
+
+
+def distance_matrix(origins, destinations, api_key, session=None, url=DISTANCE_MATRIX_URL):
+    """Makes one Distance Matrix request for every origin/destination combination"""
+    session = session or get_session()
+    params = {'origins': '|'.join(origins),
+              'destinations': '|'.join(destinations),
+              'mode': 'driving',
+              'language': 'en-EN',
+              'departure_time': 'now',
+              'key': api_key}
+    response = session.get(url, params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def matrix_entries(result, origins, destinations):
+    """{(origin, destination): (element, origin address, destination address)} for every
+    element of a Distance Matrix response"""
+    return {(origins[i], destinations[j]): (element, result['origin_addresses'][i],
+                                            result['destination_addresses'][j])
+            for i, row in enumerate(result['rows']) for j, element in enumerate(row['elements'])}
+
+
+def entry_record(entry, time_now):
+    """The sample row of one matrix entry, None when google has no traffic duration for it"""
+    element, origin, destination = entry
+    if element.get('status') != 'OK' or 'duration_in_traffic' not in element:
+        return None
+    return {'distance': element['distance']['text'],
+            'duration_in_traffic': element['duration_in_traffic']['text'],
+            'destination': destination,
+            'origin': origin,
+            'time': time_now}
+
+
+def unpack_matrix(result, origins, destinations, wanted, time_now):
+    """Turns the rows x elements of a Distance Matrix response into one record per
+    requested route. Routes are removed from 'wanted' as they are unpacked so a route
+    covered by two batches is only recorded once, unroutable elements are skipped."""
+    records = []
+    skipped = 0
+    for route, entry in matrix_entries(result, origins, destinations).items():
+        if route not in wanted:
+            continue
+        wanted.discard(route)
+        record = entry_record(entry, time_now)
+        if record is None:
+            skipped += 1
+        else:
+            records.append(record)
+    if skipped:
+        print("Skipped {} routes without a usable result".format(skipped))
+    return records
+
+
+class ResponseCache:
+    """Matrix entries by (origin, destination, departure bucket), each kept for 'ttl' seconds"""
+
+    def __init__(self, ttl=CACHE_TTL, bucket=DEPARTURE_BUCKET, clock=time.monotonic):
+        self.ttl = ttl
+        self.bucket = bucket
+        self.clock = clock
+        # With one ttl for every entry, insertion order is expiry order
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, origin, destination, when):
+        return origin, destination, int(when.timestamp() // self.bucket)
+
+    def get(self, origin, destination, when):
+        with self._lock:
+            found = self._entries.get(self.key(origin, destination, when))
+            return found[1] if found is not None and found[0] > self.clock() else None
+
+    def put(self, origin, destination, when, entry):
+        key = self.key(origin, destination, when)
+        with self._lock:
+            now = self.clock()
+            self._entries[key] = (now + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while self._entries and next(iter(self._entries.values()))[0] <= now:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenBucket:
+    """Allows 'rate' acquisitions per second on average and bursts of 'capacity'"""
+
+    def __init__(self, rate=QPS, capacity=BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available. Returns the seconds waited."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Taking the token before it exists queues later callers behind this one
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class DailyQuota:
+    """Counts the elements used today, persisted to 'path' when given so separate runs
+    (e.g. from a cronjob) and processes share one budget: every change re-reads the
+    count under an exclusive lock of '<path>.lock'"""
+
+    def __init__(self, limit=DAILY_QUOTA, path=None, today=datetime.date.today):
+        self.limit = limit
+        self.path = path
+        self.today = today
+        self.day, self.used = today().isoformat(), 0
+        self._lock = threading.Lock()
+        with self._locked():
+            self._load()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            if not self.path or fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def _load(self):
+        """Takes the saved count, starting from 0 on a new day"""
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.day, self.used = saved['day'], saved['used']
+        day = self.today().isoformat()
+        if day != self.day:
+            self.day, self.used = day, 0
+
+    def release(self, units):
+        """Returns units reserved for a request google did not answer"""
+        with self._locked():
+            self._load()
+            self.used = max(0, self.used - units)
+            self._save()
+
+    @property
+    def remaining(self):
+        with self._locked():
+            self._load()
+            return max(0, self.limit - self.used)
+
+    def reserve(self, units):
+        """Counts 'units' against today's quota, raises QuotaExceeded when they do not fit"""
+        with self._locked():
+            self._load()
+            if self.used + units > self.limit:
+                raise QuotaExceeded('{} of {} elements used on {}, {} more requested'.format(
+                    self.used, self.limit, self.day, units))
+            self.used += units
+            self._save()
+
+    def _save(self):
+        if self.path:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'day': self.day, 'used': self.used}, f)
+            os.replace(tmp, self.path)
+
+
+class MapsClient:
+    """Distance Matrix requests through the response cache, rate limiter and daily quota"""
+
+    def __init__(self, api_key, url=DISTANCE_MATRIX_URL, session=None, qps=QPS, burst=BURST,
+                 daily_quota=DAILY_QUOTA, quota_path=None, cache_ttl=CACHE_TTL,
+                 departure_bucket=DEPARTURE_BUCKET, max_retries=MAX_RETRIES, backoff_seconds=BACKOFF_SECONDS,
+                 backoff_base=BACKOFF_BASE, max_waste=MAX_WASTE, archive=None, sleep=time.sleep):
+        self.api_key = api_key
+        self.url = url
+        self.session = session or get_session()
+        self.cache = ResponseCache(cache_ttl, departure_bucket)
+        self.limiter = TokenBucket(qps, burst, sleep=sleep)
+        self.quota = DailyQuota(daily_quota, quota_path)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_base = backoff_base
+        self.max_waste = max_waste
+        self.archive = archive
+        self.sleep = sleep
+        self.metrics = collections.Counter()
+        self.latency = collections.deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.metrics[name] += value
+
+    def split(self, routes, when):
+        """Sample records for the routes cached for 'when' and the routes still to fetch"""
+        records, missing = [], []
+        routes = list(dict.fromkeys(routes))
+        for origin, destination in routes:
+            entry = self.cache.get(origin, destination, when)
+            if entry is None:
+                missing.append((origin, destination))
+                continue
+            record = entry_record(entry, when)
+            if record is not None:
+                records.append(record)
+        self._count('cache_hits', len(routes) - len(missing))
+        self._count('cache_misses', len(missing))
+        return records, missing
+
+    def batches(self, routes):
+        return route_batches(routes, self.max_waste)
+
+    def request(self, origins, destinations):
+        """One rate limited request counted against the quota, no retries. Requests that
+        fail or come back without status OK are not counted. Every response is handed to
+        the response archive, if the client has one."""
+        elements = len(origins) * len(destinations)
+        self.quota.reserve(elements)
+        self._count('throttled_seconds', self.limiter.acquire())
+        self._count('api_requests')
+        when = datetime.datetime.utcnow()
+        start = time.perf_counter()
+        try:
+            result = distance_matrix(origins, destinations, self.api_key, session=self.session, url=self.url)
+        except Exception:
+            self.quota.release(elements)
+            raise
+        finally:
+            self.latency.append(time.perf_counter() - start)
+        if self.archive is not None:
+            self.archive.record(result, origins, destinations, when)
+        if result.get('status') != 'OK':
+            self.quota.release(elements)
+        return result
+
+    def store(self, result, origins, destinations, wanted, when):
+        """Caches every element of a response, returns the records of the 'wanted' routes"""
+        for (origin, destination), entry in matrix_entries(result, origins, destinations).items():
+            self.cache.put(origin, destination, when, entry)
+        return unpack_matrix(result, origins, destinations, wanted, when)
+
+    def fetch(self, origins, destinations):
+        """request() retried with exponential backoff and jitter on network, quota and
+        server errors. Returns the response, or None once it gives up."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = self.request(origins, destinations)
+                status = result.get('status')
+            except QuotaExceeded as err:
+                self._count('quota_rejected')
+                print("Request for {} origins skipped: {}".format(len(origins), err))
+                return None
+            except (requests.RequestException, ValueError) as err:
+                result, status = None, str(err)
+            if status == 'OK':
+                return result
+            if result is not None and status not in RETRY_STATUSES:
+                break
+            if attempt < self.max_retries:
+                self._count('api_retries')
+                self.sleep(self.backoff_seconds * self.backoff_base ** attempt * (1 + random.random()))
+        self._count('api_errors')
+        print("Request for {} origins failed: {}".format(len(origins), status))
+        return None
+
+    def commute_times(self, routes, time_now=None):
+        """A dataframe with one row per route google returned a traffic duration for,
+        requesting only the routes not cached for this departure bucket. Times are UTC."""
+        time_now = time_now or datetime.datetime.utcnow()
+        records, missing = self.split(routes, time_now)
+        wanted = set(missing)
+        for origins, destinations in self.batches(missing):
+            result = self.fetch(origins, destinations)
+            if result is not None:
+                records.extend(self.store(result, origins, destinations, wanted, time_now))
+        return pd.DataFrame(records, columns=COLUMNS)
+
+    def metrics_summary(self):
+        """Cache, request and quota counters and the p50/p99 latency of the HTTP calls in
+        milliseconds"""
+        summary = {name: self.metrics[name] for name in
+                   ['cache_hits', 'cache_misses', 'api_requests', 'api_retries', 'api_errors', 'quota_rejected']}
+        lookups = summary['cache_hits'] + summary['cache_misses']
+        summary['cache_hit_rate'] = round(summary['cache_hits'] / lookups, 4) if lookups else None
+        summary['cache_entries'] = len(self.cache)
+        remaining = self.quota.remaining
+        summary['quota_used'] = self.quota.limit - remaining
+        summary['quota_remaining'] = remaining
+        summary['throttled_seconds'] = round(self.metrics['throttled_seconds'], 3)
+        latency = list(self.latency)
+        for q in [50, 99]:
+            value = percentile(latency, q)
+            summary['latency_p{}_ms'.format(q)] = None if value is None else round(value * 1000, 2)
+        return summary
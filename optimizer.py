@@ -0,0 +1,93 @@
+"""Finds the best (leave home, leave work) departure pairs for any allowed time at work.
+
+For every route, every morning slot i and evening slot j are paired. The time on site
+is the evening departure minus the morning arrival, and the morning arrival is the
+morning departure plus the route's expected duration by the chosen metric. A pair is
+feasible when its time on site, floored to the step of the allowed durations, is one
+of the allowed durations. The pair's score is the sum of the morning and evening
+metric. All routes and pairs are scored in vectorized NumPy, in blocks of routes so
+memory stays bounded on fine slot grids."""
+
+import numpy as np
+import pandas as pd
+from schema import slot_labels
+
+# Allowed minutes on site: 7.5 to 10 hours in 5 minute steps
+ON_SITE_MINUTES = np.arange(450, 601, 5)
+TOP_K = 5
+# Upper bound on route x pair scores held in memory at once
+BLOCK_CELLS = 4000000
+
+
+def _metric_column(metric):
+    """Column of the duration_in_traffic level to score by, numbers mean percentiles"""
+    return 'perc_{:g}'.format(metric) if isinstance(metric, (int, float)) else metric
+
+
+def _grid(tables, routes, column):
+    """(routes x slots) array of the metric and the sorted slot minutes"""
+    slots = tables['slot'].to_numpy(dtype=int)
+    grid = np.unique(slots)
+    values = np.full((len(routes), len(grid)), np.nan)
+    keys = pd.MultiIndex.from_arrays([tables['home'], tables['work']])
+    values[routes.get_indexer(keys), np.searchsorted(grid, slots)] = tables['duration_in_traffic'][column]
+    return values, grid
+
+
+def departure_windows(morning, evening, on_site=ON_SITE_MINUTES, metric='mean', k=TOP_K):
+    """Top k departure pairs per route from time_aggregator's morning and evening tables.
+    'metric' is any duration_in_traffic statistic ('mean', 'median', 'perc_95', ...) or a
+    percentile number when that column exists. Returns one row per window ranked by
+    total minutes."""
+    column = _metric_column(metric)
+    # Routes of either table, so a route seen in one direction only keeps its own row
+    routes = pd.MultiIndex.from_arrays([morning['home'], morning['work']]).append(
+        pd.MultiIndex.from_arrays([evening['home'], evening['work']])).unique()
+    mornings, morning_grid = _grid(morning, routes, column)
+    evenings, evening_grid = _grid(evening, routes, column)
+    on_site = np.unique(np.asarray(on_site, dtype=int))
+    step = np.diff(on_site).min() if len(on_site) > 1 else 1
+    # allowed[n] is whether on_site[0] + n * step minutes on site is allowed
+    allowed = np.zeros((on_site[-1] - on_site[0]) // step + 1, dtype=bool)
+    allowed[(on_site - on_site[0]) // step] = True
+    # Only pairs that are feasible for some duration can be feasible for a route
+    spread = evening_grid[None, :] - morning_grid[:, None]
+    longest = np.nanmax(mornings) if np.isfinite(mornings).any() else 0
+    i, j = np.nonzero((spread >= on_site[0]) & (spread <= on_site[-1] + longest + step))
+    results = []
+    block = max(1, BLOCK_CELLS // max(len(i), 1))
+    for first in range(0, len(routes), block):
+        rows = slice(first, first + block)
+        travel = mornings[rows][:, i]
+        stay = spread[i, j][None, :] - travel
+        steps = np.floor((stay - on_site[0]) / step)
+        inside = (steps >= 0) & (steps < len(allowed))
+        feasible = inside & allowed[np.where(inside, steps, 0).astype(int)]
+        total = np.where(feasible, travel + evenings[rows][:, j], np.inf)
+        total[np.isnan(total)] = np.inf
+        top = min(k, total.shape[1])
+        if not top:
+            continue
+        best = np.argpartition(total, top - 1, axis=1)[:, :top]
+        best_total = np.take_along_axis(total, best, axis=1)
+        order = np.argsort(best_total, axis=1, kind='mergesort')
+        best = np.take_along_axis(best, order, axis=1)
+        route_idx = np.repeat(np.arange(first, first + best.shape[0]), top)
+        pair = best.ravel()
+        scores = np.take_along_axis(total, best, axis=1).ravel()
+        found = np.isfinite(scores)
+        route_idx, pair, scores = route_idx[found], pair[found], scores[found]
+        results.append(pd.DataFrame({
+            'home': routes.get_level_values(0)[route_idx],
+            'work': routes.get_level_values(1)[route_idx],
+            'rank': np.tile(np.arange(1, top + 1), best.shape[0])[found],
+            'leave_home': slot_labels(morning_grid[i[pair]]),
+            'leave_work': slot_labels(evening_grid[j[pair]]),
+            'on_site_minutes': stay[route_idx - first, pair],
+            'morning': mornings[route_idx, i[pair]],
+            'evening': evenings[route_idx, j[pair]],
+            'total': scores}))
+    if not results:
+        return pd.DataFrame(columns=['home', 'work', 'rank', 'leave_home', 'leave_work', 'on_site_minutes',
+                                     'morning', 'evening', 'total'])
+    return pd.concat(results, ignore_index=True)
@@ -1,6 +1,13 @@
+import os
 import plotly.graph_objs as go
 import pandas as pd
 import plotly as py
+from profiling import stage
+from schema import slot_labels
+from rollups import timeline_step
+
+# Days averaged by the rolling total of the daily plot
+ROLLING_DAYS = 5
 
 
 def plot_data_to_html(func):
@@ -9,12 +16,18 @@ def plot_data_to_html(func):
     :param func: plot function
     :return: data ready for plot with y-axis values converted
     """
-    def wrapper_plot_data_to_html(*args, **kwargs):
-        plot_data, filename = func(*args, **kwargs)
-        py.offline.plot(plot_data, config=dict(modeBarButtonsToRemove=['sendDataToCloud'], showLink=False,
-                                               displayModeBar=False,),
-                        filename=filename)
+    def wrapper_plot_data_to_html(*args, filename_prefix='', **kwargs):
+        with stage(func.__name__ + ' build'):
+            plot_data, filename = func(*args, **kwargs)
+        directory, name = os.path.split(filename)
+        filename = os.path.join(directory, filename_prefix + name)
+        with stage(func.__name__ + ' write'):
+            py.offline.plot(plot_data, config=dict(modeBarButtonsToRemove=['sendDataToCloud'], showLink=False,
+                                                   displayModeBar=False,),
+                            filename=filename)
         return
+    # The undecorated function, builds the figure without writing html
+    wrapper_plot_data_to_html.build = func
     return wrapper_plot_data_to_html
 
 
@@ -23,9 +36,6 @@ def mean_commute_time_plot(morning, evening, beg_range=25, end_range=60):
     """Makes a plot with two buttons to toggle between morning and
        evening commutes. 'beg_range' and 'end_range' toggle the yaxis for
        a clearer plot"""
-    # Removing seconds for aesthetics for axis labels
-    morning['hour_min'] = morning['hour_min'].astype(str).str[:-3]
-    evening['hour_min'] = evening['hour_min'].astype(str).str[:-3]
     data = []
 
     updatemenus = [dict(type="buttons",
@@ -40,21 +50,22 @@ def mean_commute_time_plot(morning, evening, beg_range=25, end_range=60):
         viz = True
         if num == 1:
             viz = False
+        labels = slot_labels(df['slot'])
 
-        data.append(go.Scatter(x=df['hour_min'],
+        data.append(go.Scatter(x=labels,
                                  y=df['duration_in_traffic']['mean'],
                                  line=dict(color='black', width=3, dash='dash'),
                                  name='Average {} Commute'.format(PLOT_NAMES[num]),
                                  visible=viz))
 
-        data.append(go.Scatter(x=df['hour_min'],
+        data.append(go.Scatter(x=labels,
                                  y=df['duration_in_traffic']['perc_95'],
                                  line=dict(color='rgb(202,225,255)'),
                                  name='95th Percentile',
                                  showlegend=False,
                                  visible=viz))
 
-        data.append(go.Scatter(x=df['hour_min'],
+        data.append(go.Scatter(x=labels,
                                  y=df['duration_in_traffic']['perc_5'],
                                  line=dict(color='rgb(202,225,255)'),
                                  name='5th Percentile',
@@ -79,14 +90,15 @@ def mean_commute_time_plot(morning, evening, beg_range=25, end_range=60):
 
 
 @plot_data_to_html
-def daily_commute_time_plot(df, yaxismax=100):
+def daily_commute_time_plot(daily, yaxismax=100):
     """Plots average daily commute times and returns interactive html.
-    Excludes weekends & holidays and plots them as dashed lines"""
-    df['date'] = df['time'].dt.date
-    daily = df.groupby(['date', 'is_morning'], as_index=False)['duration_in_traffic'].mean()
-
+    Excludes weekends & holidays and plots them as dashed lines
+    :param daily: Average commute time per date and is_morning, see daily_averages. Weekly
+    or monthly averages are plotted per week or month, without the rolling average
+    """
     # Reindexing to account for weekends/holidays
-    time_index = pd.date_range(start=daily['date'].min(), end=daily['date'].max())
+    step = timeline_step(daily['date'])
+    time_index = pd.date_range(start=daily['date'].min(), end=daily['date'].max(), freq=step)
 
     morning = daily.loc[daily['is_morning'] == 1].drop('is_morning', axis=1).copy()
     morning = morning.set_index('date').reindex(time_index)
@@ -95,7 +107,8 @@ def daily_commute_time_plot(df, yaxismax=100):
     evening = evening.set_index('date').reindex(time_index)
 
     # Rolling Average of Total Daily Commute Times (excluding weekends/holidays)
-    rolling_avg = daily.groupby('date')['duration_in_traffic'].sum().rolling(5).mean()
+    rolling_avg = daily.groupby('date')['duration_in_traffic'].sum()
+    rolling_avg = rolling_avg.rolling(ROLLING_DAYS if step == 'D' else 1).mean()
     rolling_avg = rolling_avg.reindex(time_index)
 
     # Individual lines on chart
@@ -129,7 +142,7 @@ def daily_commute_time_plot(df, yaxismax=100):
 
     trace5 = go.Scatter(x=rolling_avg.index,
                         y=rolling_avg.values,
-                        name='Total Time (Rolling Avg.)',
+                        name='Total Time (Rolling Avg.)' if step == 'D' else 'Total Time',
                         line=dict(color='purple'))
 
     layout = go.Layout(legend=dict(x=1, y=1.1, xanchor='right'),
@@ -189,40 +202,33 @@ def lost_time_plot(merged):
 
 
 @plot_data_to_html
-def commute_distance_variation_plot(df):
+def commute_distance_variation_plot(frames):
     """
     Creates plot with 4 subplots of commute distance variation for evening/morning commutes.
-    :param df: Data Frame of Cleaned Commute Data
+    :param frames: [evening, morning] mean miles and num_commutes by slot, see distance_variation
     :return: Plot data of distance variations with 4 subplots
     """
-    frames = []
-    # 0 is evening, 1 is morning
-    for i in range(2):
-        commute = df.loc[df['is_morning'] == i].copy()
-        commute = commute.groupby('hour_min').agg({'distance': ['mean', 'unique']})
-        commute.columns = commute.columns.droplevel()
-        commute['num_commutes'] = commute['unique'].apply(len)
-        frames.append(commute)
-
-    trace1 = go.Scatter(x=frames[1].index.astype(str).str[:-3],
+
+    labels = [slot_labels(frame.index.get_level_values('slot')) for frame in frames]
+    trace1 = go.Scatter(x=labels[1],
                         y=frames[1]['mean'],
                         showlegend=False,
                         name='Avg. Miles'
                         )
 
-    trace2 = go.Scatter(x=frames[0].index.astype(str).str[:-3],
+    trace2 = go.Scatter(x=labels[0],
                         y=frames[0]['mean'],
                         showlegend=False,
                         name='Avg. Miles')
 
-    trace3 = go.Bar(x=frames[1].index.astype(str).str[:-3],
+    trace3 = go.Bar(x=labels[1],
                     y=frames[1]['num_commutes'],
                     showlegend=False,
                     name='# of Routes',
                     marker=dict(color='blue')
                     )
 
-    trace4 = go.Bar(x=frames[0].index.astype(str).str[:-3],
+    trace4 = go.Bar(x=labels[0],
                     y=frames[0]['num_commutes'],
                     showlegend=False,
                     name='# of Routes',
@@ -0,0 +1,130 @@
+"""Opt-in timing and memory instrumentation for the analysis pipeline.
+Stages are wrapped with the 'instrumented' decorator or the 'stage' context manager.
+Until start_run() is called both reduce to a flag check, so they can stay in place.
+Per stage peak memory needs tracemalloc.reset_peak (Python 3.9+), stages that run in
+worker processes are not recorded."""
+
+import json
+import time
+import cProfile
+import functools
+import tracemalloc
+import pandas as pd
+
+ENABLED = False
+_records = []
+_stack = []
+_run = {}
+
+
+def _rows(value):
+    """Row count of a frame, or of the first frame in a tuple/list result"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)) and value and isinstance(value[0], (pd.DataFrame, pd.Series)):
+        return len(value[0])
+    return None
+
+
+def _traced():
+    return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+
+
+class _Stage:
+    """Context manager recording one stage, see stage()"""
+
+    def __init__(self, name, rows_in=None):
+        self.record = {'stage': name, 'depth': len(_stack), 'rows_in': rows_in, 'rows_out': None}
+
+    def __enter__(self):
+        current, peak = _traced()
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak') and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.state = {'peak': current, 'start_bytes': current}
+        _stack.append(self.state)
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        self.record['started_seconds'] = self.wall - _run['wall']
+        return self.record
+
+    def __exit__(self, *exc):
+        self.record['wall_seconds'] = time.perf_counter() - self.wall
+        self.record['cpu_seconds'] = time.process_time() - self.cpu
+        _stack.pop()
+        peak = max(self.state['peak'], _traced()[1])
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            self.record['peak_mb'] = round(peak / 1e6, 3)
+            self.record['stage_peak_mb'] = round((peak - self.state['start_bytes']) / 1e6, 3)
+        _records.append(self.record)
+        return False
+
+
+class _NullStage:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, rows_in=None):
+    """Context manager timing a block, set ['rows_out'] on the yielded record to report
+    the rows it produced"""
+    return _Stage(name, rows_in) if ENABLED else _NULL_STAGE
+
+
+def instrumented(name=None):
+    """Decorator recording wall time, CPU time, peak memory and the row counts of the
+    first argument and the result of each call"""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _Stage(label, _rows(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = _rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def start_run(report_path, profile_path=None):
+    """Enables instrumentation, tracing memory and, with profile_path, cProfile"""
+    global ENABLED
+    ENABLED = True
+    del _records[:]
+    tracemalloc.start()
+    _run.update({'report_path': report_path, 'profile_path': profile_path,
+                 'wall': time.perf_counter(), 'cpu': time.process_time(), 'profiler': None})
+    if profile_path:
+        _run['profiler'] = cProfile.Profile()
+        _run['profiler'].enable()
+
+
+def finish_run():
+    """Writes the JSON run report (and cProfile stats) and disables instrumentation.
+    Returns the report."""
+    global ENABLED
+    if _run.get('profiler'):
+        _run['profiler'].disable()
+        _run['profiler'].dump_stats(_run['profile_path'])
+    report = {'wall_seconds': time.perf_counter() - _run['wall'],
+              'cpu_seconds': time.process_time() - _run['cpu'],
+              'peak_mb': round(max([r['peak_mb'] for r in _records if 'peak_mb' in r] +
+                                   [_traced()[1] / 1e6]), 3),
+              'stages': sorted(_records, key=lambda record: record['started_seconds'])}
+    tracemalloc.stop()
+    ENABLED = False
+    with open(_run['report_path'], 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print('Wrote run report to {}'.format(_run['report_path']))
+    return report
@@ -0,0 +1,238 @@
+"""Serves precomputed commute statistics over HTTP for other tools.
+
+Loads the per route and weekday aggregates written by 'cli.py export'
+into dictionaries keyed by (route, weekday, direction), answers repeated queries from an
+LRU cache of encoded responses and reloads the aggregates when the file changes.
+Run with 'python query_service.py [--aggregates PATH] [--port PORT]'.
+
+GET /routes                                         route ids and addresses
+GET /best?route=ID&weekday=tue&direction=morning&metric=mean&k=3
+                                                    fastest departure slots
+GET /slot?route=ID&weekday=tue&direction=evening&time=17:32
+                                                    statistics of the slot holding 'time' (HH:MM)
+GET /windows?route=ID&weekday=all&k=5               best (leave home, leave work) pairs
+GET /health                                         load time and cache counters
+
+Routes can be given as 'route' (see /routes) or as 'home' and 'work' addresses, weekday
+is one of mon..fri or 'all' (the default)."""
+
+import os
+import json
+import re
+import time
+import argparse
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import pandas as pd
+from commute_analyzer import SLOT_MINUTES
+from schema import route_id
+
+AGGREGATES_PATH = './commute_aggregates.pkl'
+HOST = '127.0.0.1'
+PORT = 8050
+CACHE_SIZE = 4096
+# Seconds between checks of the aggregates file for changes
+RELOAD_INTERVAL = 2.0
+TOP_K = 3
+TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+def _plain(value):
+    """JSON encoding for numpy scalars"""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _error(error):
+    return json.dumps({'error': ' '.join(str(arg) for arg in error.args)}).encode('utf-8')
+
+
+def _minutes(text):
+    """Minute of the day of an 'HH:MM' time"""
+    match = TIME_PATTERN.match(text)
+    if match is None:
+        raise ValueError('malformed time {!r}, expected HH:MM'.format(text))
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def _top(params):
+    """The number of results asked for, 'k'"""
+    text = params.get('k', str(TOP_K))
+    if not text.isdigit() or int(text) < 1:
+        raise ValueError('k must be a positive integer, not {!r}'.format(text))
+    return int(text)
+
+
+def _records(rows, drop):
+    return rows.drop(columns=drop).to_dict('records')
+
+
+class AggregateIndex:
+    """In memory lookups over one aggregates file"""
+
+    def __init__(self, aggregates, loaded=None):
+        slots, windows = aggregates['slots'], aggregates['windows']
+        self.loaded = loaded or time.time()
+        self.routes = {}
+        self.slots = {}
+        self.slot_records = {}
+        for (home, work, weekday, direction), rows in slots.groupby(['home', 'work', 'weekday', 'direction']):
+            route = route_id(home, work)
+            self.routes[route] = {'route': route, 'home': home, 'work': work}
+            rows = rows.sort_values('hour_min')
+            records = _records(rows, ['home', 'work', 'weekday', 'direction'])
+            self.slots[(route, weekday, direction)] = records
+            self.slot_records[(route, weekday, direction)] = {
+                _minutes(record['hour_min']): record for record in records}
+        self.windows = {(route_id(home, work), weekday): _records(rows.sort_values('rank'),
+                                                                  ['home', 'work', 'weekday'])
+                        for (home, work, weekday), rows in windows.groupby(['home', 'work', 'weekday'])}
+
+    def _key(self, params, direction=True):
+        if 'home' in params or 'work' in params:
+            if 'home' not in params or 'work' not in params:
+                raise ValueError('home and work are both required')
+            route = route_id(params['home'], params['work'])
+        elif 'route' in params:
+            route = params['route']
+        else:
+            raise ValueError('route, or home and work, is required')
+        if route not in self.routes:
+            raise KeyError('unknown route {}'.format(route))
+        key = (route, params.get('weekday', 'all'))
+        if direction:
+            key += (params.get('direction', 'morning'),)
+        if key not in (self.slots if direction else self.windows):
+            raise KeyError('no data for {}'.format(', '.join(key[1:])))
+        return key
+
+    def best(self, params):
+        metric, k = params.get('metric', 'mean'), _top(params)
+        records = self.slots[self._key(params)]
+        if metric not in records[0]:
+            raise ValueError('unknown metric {}'.format(metric))
+        return sorted(records, key=lambda record: record[metric])[:k]
+
+    def slot(self, params):
+        if 'time' not in params:
+            raise ValueError('time is required')
+        minutes = _minutes(params['time'])
+        found = self.slot_records[self._key(params)].get(minutes // SLOT_MINUTES * SLOT_MINUTES)
+        if found is None:
+            raise KeyError('no slot at {}'.format(params['time']))
+        return found
+
+    def window(self, params):
+        k = _top(params)
+        return self.windows[self._key(params, direction=False)][:k]
+
+    def answer(self, endpoint, query):
+        """JSON encoded answer to one query, query is a tuple of (name, value) pairs"""
+        params = dict(query)
+        if endpoint == '/routes':
+            result = sorted(self.routes.values(), key=lambda route: (route['home'], route['work']))
+        elif endpoint == '/best':
+            result = self.best(params)
+        elif endpoint == '/slot':
+            result = self.slot(params)
+        elif endpoint == '/windows':
+            result = self.window(params)
+        else:
+            raise LookupError(endpoint)
+        return json.dumps(result, default=_plain).encode('utf-8')
+
+
+class QueryService:
+    """Holds the current index and its response cache, swapping both on reload"""
+
+    def __init__(self, path=AGGREGATES_PATH, cache_size=CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.mtime = None
+        self.reload()
+
+    def reload(self):
+        """Loads the aggregates if the file changed since the last load, returns whether it did"""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+        index = AggregateIndex(pd.read_pickle(self.path))
+        # One assignment so request threads see either the old or the new pair
+        self.current = (index, lru_cache(self.cache_size)(index.answer))
+        self.mtime = mtime
+        print('Loaded {} routes from {}'.format(len(index.routes), self.path))
+        return True
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        """Starts a daemon thread reloading the aggregates when they are rewritten"""
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except (OSError, KeyError, ValueError) as error:
+                    print('Reload of {} failed: {}'.format(self.path, error))
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return thread
+
+    def query(self, endpoint, params):
+        index, cached = self.current
+        if endpoint == '/health':
+            info = cached.cache_info()
+            return json.dumps({'loaded': index.loaded, 'routes': len(index.routes), 'cache_hits': info.hits,
+                               'cache_misses': info.misses, 'cache_size': info.currsize}).encode('utf-8')
+        return cached(endpoint, tuple(sorted(params.items())))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, every response has a Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, without TCP_NODELAY each response waits
+    # ~40ms on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            status, body = 200, self.server.service.query(url.path, dict(parse_qsl(url.query)))
+        except LookupError as error:
+            status, body = 404, _error(error)
+        except ValueError as error:
+            status, body = 400, _error(error)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service, host=HOST, port=PORT):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main(path=AGGREGATES_PATH, host=HOST, port=PORT):
+    service = QueryService(path)
+    service.watch()
+    server = make_server(service, host, port)
+    print('Serving commute statistics on http://{}:{}'.format(host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--aggregates', default=AGGREGATES_PATH)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    main(args.aggregates, args.host, args.port)
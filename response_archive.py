@@ -0,0 +1,158 @@
+"""Archive of the raw Distance Matrix responses the collectors receive.
+
+Every response (statuses and failed lookups included) becomes one JSON line holding the
+request time in UTC, the origins and destinations asked for and the response itself.
+Lines are buffered and appended as one gzip member per flush, so files stay readable
+with plain gzip/zcat; a member cut short by a crash is skipped by read_responses. Files
+are named responses-YYYY-MM-DD-NNN.jsonl.gz and rotate daily and once they reach
+'rotate_bytes'. archived_samples turns the archive back into a frame of numeric seconds
+and meters."""
+
+import os
+import re
+import glob
+import gzip
+import json
+import zlib
+import datetime
+import threading
+import pandas as pd
+
+ARCHIVE_DIR = './responses'
+ROTATE_BYTES = 64 * 1024 * 1024
+FLUSH_RECORDS = 50
+FILE_PATTERN = re.compile(r'responses-(\d{4}-\d{2}-\d{2})-(\d{3})\.jsonl\.gz$')
+
+
+class ResponseArchive:
+    """Thread safe; call close() (or use it as a context manager) to write what is
+    still buffered"""
+
+    def __init__(self, directory=ARCHIVE_DIR, rotate_bytes=ROTATE_BYTES, flush_records=FLUSH_RECORDS):
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.flush_records = flush_records
+        self.lines = []
+        self.day = None
+        self.archived = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, result, origins, destinations, when=None):
+        """Archives one response, 'when' is the time of the request"""
+        when = when or datetime.datetime.utcnow()
+        line = json.dumps({'time': when.isoformat(), 'origins': list(origins), 'destinations': list(destinations),
+                           'response': result}, separators=(',', ':'))
+        with self._lock:
+            if self.day is not None and self.day != when.date():
+                self._flush()
+            self.day = when.date()
+            self.lines.append(line.encode('utf-8') + b'\n')
+            if len(self.lines) >= self.flush_records:
+                self._flush()
+
+    def _path(self):
+        """The newest file of the current day, or the next one once it is full"""
+        day = self.day.isoformat()
+        numbers = [int(FILE_PATTERN.search(path).group(2)) for path in
+                   glob.glob(os.path.join(self.directory, 'responses-{}-*.jsonl.gz'.format(day)))]
+        number = max(numbers, default=0)
+        path = os.path.join(self.directory, 'responses-{}-{:03d}.jsonl.gz'.format(day, number))
+        if os.path.exists(path) and os.path.getsize(path) >= self.rotate_bytes:
+            path = os.path.join(self.directory, 'responses-{}-{:03d}.jsonl.gz'.format(day, number + 1))
+        return path
+
+    def _flush(self):
+        if not self.lines:
+            return
+        data = gzip.compress(b''.join(self.lines))
+        fd = os.open(self._path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.archived += len(self.lines)
+        self.lines = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _members(path):
+    """The decompressed gzip members of a file, up to the first incomplete one"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            chunk = decompressor.decompress(data)
+        except zlib.error:
+            return
+        if not decompressor.eof:
+            return
+        yield chunk
+        data = decompressor.unused_data
+
+
+def archive_files(directory=ARCHIVE_DIR, start=None, end=None):
+    """Archive files from the days between start and end (inclusive), in order"""
+    start = None if start is None else pd.Timestamp(start).strftime('%Y-%m-%d')
+    end = None if end is None else pd.Timestamp(end).strftime('%Y-%m-%d')
+    found = []
+    for path in sorted(glob.glob(os.path.join(directory, 'responses-*.jsonl.gz'))):
+        match = FILE_PATTERN.search(path)
+        if match and not ((start and match.group(1) < start) or (end and match.group(1) > end)):
+            found.append(path)
+    return found
+
+
+def read_responses(directory=ARCHIVE_DIR, start=None, end=None):
+    """Yields the archived records of the days between start and end"""
+    for path in archive_files(directory, start, end):
+        for chunk in _members(path):
+            for line in chunk.splitlines():
+                yield json.loads(line)
+
+
+def _value(element, field):
+    return element.get(field, {}).get('value')
+
+
+def archived_samples(directory=ARCHIVE_DIR, start=None, end=None):
+    """One row per archived element with its status and numeric values:
+    distance_m, duration_s and duration_in_traffic_s, besides the google formatted
+    origin/destination addresses and the origin_query/destination_query asked for.
+    Elements of responses without status OK have that response status."""
+    rows = []
+    for record in read_responses(directory, start, end):
+        response = record['response']
+        status = response.get('status')
+        origins = response.get('origin_addresses') or record['origins']
+        destinations = response.get('destination_addresses') or record['destinations']
+        results = response.get('rows') or [{'elements': [{}] * len(record['destinations'])}] * len(record['origins'])
+        for i, row in enumerate(results):
+            for j, element in enumerate(row['elements']):
+                rows.append((record['time'], origins[i], destinations[j], record['origins'][i],
+                             record['destinations'][j], element.get('status', status) if status == 'OK' else status,
+                             _value(element, 'distance'), _value(element, 'duration'),
+                             _value(element, 'duration_in_traffic')))
+    df = pd.DataFrame(rows, columns=['time', 'origin', 'destination', 'origin_query', 'destination_query', 'status',
+                                     'distance_m', 'duration_s', 'duration_in_traffic_s'])
+    df['time'] = pd.to_datetime(df['time'])
+    for column in ['distance_m', 'duration_s', 'duration_in_traffic_s']:
+        df[column] = df[column].astype('float64').astype('Int64')
+    return df
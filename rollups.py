@@ -0,0 +1,196 @@
+"""Materialized rollups of commute durations per route, direction and calendar period.
+
+One table per tier (5min, hour, day, week starting Monday, month), indexed by home, work,
+is_morning and the start of the period, holds the count, sum, min and max of the
+durations and the sum of the miles. These all merge by addition or min/max, so fold()
+only aggregates the new samples (each tier from the next finer one) and merges the
+periods they touch. view() answers a query for any pandas frequency from the coarsest
+tier whose periods and range boundaries line up with it, so month and year views only
+read the month table; timeline() picks a day, week or month resolution that keeps a
+time series within MAX_POINTS points.
+
+The 5min and hour tiers only keep the most recent RETENTION of periods, so the tables
+grow with the number of routes and days rather than samples. 'horizons' records where
+each pruned tier now starts; view() does not answer queries reaching further back from
+them."""
+
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
+
+KEYS = ['home', 'work', 'is_morning', 'period']
+COLUMNS = ['count', 'sum', 'min', 'max', 'distance_sum']
+AGGREGATIONS = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max', 'distance_sum': 'sum'}
+# Tier, the pandas frequency of its periods and the tier it is rolled up from
+TIERS = ['5min', 'hour', 'day', 'week', 'month']
+FREQS = {'5min': '5min', 'hour': 'H', 'day': 'D', 'week': 'W', 'month': 'M'}
+PARENTS = {'hour': '5min', 'day': 'hour', 'week': 'day', 'month': 'day'}
+TIMELINE_TIERS = ['day', 'week', 'month']
+MAX_POINTS = 400
+RETENTION = {'5min': pd.Timedelta(35, unit='D'), 'hour': pd.Timedelta(400, unit='D')}
+
+
+def period_starts(times, freq):
+    """Start of the 'freq' period each timestamp falls in"""
+    times = pd.DatetimeIndex(times)
+    if isinstance(to_offset(freq), Tick):
+        return times.floor(freq)
+    return times.to_period(freq).to_timestamp(how='start')
+
+
+def period_ends(starts, freq):
+    """Last nanosecond of the 'freq' periods starting at 'starts'"""
+    starts = pd.DatetimeIndex(starts)
+    offset = to_offset(freq)
+    if isinstance(offset, Tick):
+        ends = starts + offset.delta
+    else:
+        ends = (starts.to_period(freq) + 1).to_timestamp(how='start')
+    return ends - pd.Timedelta(1, unit='ns')
+
+
+def empty_rollups():
+    index = pd.MultiIndex.from_arrays([[]] * len(KEYS), names=KEYS)
+    rollups = {tier: pd.DataFrame(columns=COLUMNS, index=index) for tier in TIERS}
+    rollups['horizons'] = {}
+    return rollups
+
+
+def _aggregate(df):
+    """The 5min tier of a frame of cleaned samples"""
+    keys = [df['home'].astype(object), df['work'].astype(object), df['is_morning'].astype(bool),
+            pd.Series(period_starts(df['time'], FREQS['5min']), index=df.index, name='period')]
+    grouped = df.groupby(keys)
+    durations = grouped['duration_in_traffic']
+    table = pd.DataFrame({'count': durations.size(), 'sum': durations.sum().astype('int64'),
+                          'min': durations.min().astype('int64'), 'max': durations.max().astype('int64'),
+                          'distance_sum': grouped['distance'].sum().astype('float64')})
+    table.index.names = KEYS
+    return table
+
+
+def _coarsen(table, tier):
+    """Rolls a tier up to the coarser 'tier'"""
+    flat = table.reset_index()
+    flat['period'] = period_starts(flat['period'], FREQS[tier])
+    return flat.groupby(KEYS).agg(AGGREGATIONS)
+
+
+def _merge(table, new):
+    """Adds the periods of 'new' to a tier table, only regrouping the ones both have"""
+    if len(table) == 0:
+        return new
+    combined = pd.concat([table, new])
+    repeated = combined.index.duplicated(keep=False)
+    if repeated.any():
+        merged = combined.loc[repeated].groupby(level=KEYS).agg(AGGREGATIONS)
+        combined = pd.concat([combined.loc[~repeated], merged])
+    return combined.sort_index()
+
+
+def _prune(rollups, retention):
+    """Drops the periods of each tier in 'retention' that start over that long before
+    its newest period"""
+    horizons = dict(rollups.get('horizons', {}))
+    for tier, keep in retention.items():
+        periods = rollups[tier].index.get_level_values('period')
+        if len(periods) == 0:
+            continue
+        horizon = (periods.max() - keep).normalize()
+        if (periods < horizon).any():
+            rollups[tier] = rollups[tier].loc[periods >= horizon]
+            horizons[tier] = max(horizon, horizons.get(tier, horizon))
+    rollups['horizons'] = horizons
+    return rollups
+
+
+def fold(rollups, df, retention=RETENTION):
+    """Folds cleaned samples (as passed to time_aggregator) into every tier"""
+    if df.empty:
+        return rollups
+    batch = {'5min': _aggregate(df)}
+    for tier in TIERS[1:]:
+        batch[tier] = _coarsen(batch[PARENTS[tier]], tier)
+    folded = {tier: _merge(rollups[tier], batch[tier]) for tier in TIERS}
+    folded['horizons'] = rollups.get('horizons', {})
+    return _prune(folded, retention or {})
+
+
+def build_rollups(df, retention=RETENTION):
+    return fold(empty_rollups(), df, retention)
+
+
+def _bounds(start, end):
+    """start and the exclusive end of a date range with an inclusive end date"""
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end).normalize() + pd.Timedelta(1, unit='D')
+    return start, end
+
+
+def answering_tier(rollups, freq, start=None, end=None):
+    """The coarsest tier whose periods each fall in a single 'freq' period, whose period
+    boundaries include start and end and that still holds every period from start on"""
+    start, end = _bounds(start, end)
+    boundaries = pd.DatetimeIndex([bound for bound in [start, end] if bound is not None])
+    for tier in reversed(TIERS):
+        horizon = rollups.get('horizons', {}).get(tier)
+        if horizon is not None and (start is None or start < horizon):
+            continue
+        if not (period_starts(boundaries, FREQS[tier]) == boundaries).all():
+            continue
+        periods = rollups[tier].index.get_level_values('period').unique()
+        if (period_starts(periods, freq) == period_starts(period_ends(periods, FREQS[tier]), freq)).all():
+            return tier
+    raise ValueError('No rollup tier answers frequency {!r}'.format(freq))
+
+
+def view(rollups, freq, start=None, end=None):
+    """Duration count, mean, min and max and mean miles per route, direction and 'freq'
+    period between start and end (an inclusive date), read from answering_tier"""
+    tier = answering_tier(rollups, freq, start, end)
+    flat = rollups[tier].reset_index()
+    start, end = _bounds(start, end)
+    if start is not None:
+        flat = flat.loc[flat['period'] >= start]
+    if end is not None:
+        flat = flat.loc[flat['period'] < end]
+    flat['period'] = period_starts(flat['period'], freq)
+    table = flat.groupby(KEYS, as_index=False).agg(AGGREGATIONS)
+    table['mean'] = table['sum'] / table['count']
+    table['distance'] = table['distance_sum'] / table['count']
+    table['is_morning'] = table['is_morning'].astype(bool)
+    return table[KEYS + ['count', 'mean', 'min', 'max', 'distance']]
+
+
+def timeline_freq(first, last, max_points=MAX_POINTS):
+    """Frequency of the finest of day, week and month with at most max_points periods
+    from first to last"""
+    days = (pd.Timestamp(last) - pd.Timestamp(first)).days + 1
+    for tier, days_per_period in zip(TIMELINE_TIERS, [1, 7, 31]):
+        if days <= max_points * days_per_period:
+            return FREQS[tier]
+    return FREQS['month']
+
+
+def timeline(rollups, start=None, end=None, max_points=MAX_POINTS):
+    """Average duration per route, direction and day, week or month (see timeline_freq),
+    named like daily_averages with the period start as 'date'"""
+    days = rollups['day'].index.get_level_values('period')
+    if len(days) == 0:
+        return pd.DataFrame(columns=['home', 'work', 'date', 'is_morning', 'duration_in_traffic'])
+    first = days.min() if start is None else pd.Timestamp(start)
+    last = days.max() if end is None else pd.Timestamp(end)
+    table = view(rollups, timeline_freq(first, last, max_points), start, end)
+    table = table.rename(columns={'period': 'date', 'mean': 'duration_in_traffic'})
+    table = table.sort_values(['home', 'work', 'date', 'is_morning']).reset_index(drop=True)
+    return table[['home', 'work', 'date', 'is_morning', 'duration_in_traffic']]
+
+
+def timeline_step(dates):
+    """The frequency of the dates of a timeline, for reindexing it over its range"""
+    gaps = pd.Series(pd.DatetimeIndex(dates).unique()).sort_values().diff().dropna()
+    if len(gaps) and gaps.min() >= pd.Timedelta(28, unit='D'):
+        return 'MS'
+    if len(gaps) and gaps.min() >= pd.Timedelta(7, unit='D'):
+        return 'W-MON'
+    return 'D'
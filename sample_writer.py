@@ -0,0 +1,156 @@
+"""Crash safe, buffered writing of collected samples.
+
+BufferedSampleWriter keeps sample frames in memory and appends them in batches, every
+'flush_rows' samples or once the oldest has waited 'flush_seconds' seconds. Samples
+still buffered when the process dies are lost; flush_seconds bounds what a crash can
+cost as long as the owner calls flush_due() periodically, which the daemon does every
+tick, including ticks without samples. CSV batches are
+appended by append_csv in a single write under an exclusive lock, after saving the batch
+and the file size it starts at to '<path>.pending'. recover_csv, which every append runs
+first, cuts a torn batch back to that size and writes it again, so a crash never leaves
+half a row or a duplicated batch behind. The parquet store (storage.write_samples)
+already writes each file under a temporary name; its recovery removes stale ones."""
+
+import os
+import time
+import threading
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock, appends are then unlocked
+    fcntl = None
+
+PATH = './commute_info.csv'
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 900
+
+
+def _lock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _recover(fd, path):
+    """recover_csv on an already locked file descriptor"""
+    pending = path + '.pending'
+    if not os.path.exists(pending):
+        return False
+    with open(pending, 'rb') as f:
+        offset, data = f.read().split(b'\n', 1)
+    offset = int(offset)
+    size = os.fstat(fd).st_size
+    if size < offset + len(data) or os.pread(fd, len(data), offset) != data:
+        os.ftruncate(fd, offset)
+        os.lseek(fd, offset, os.SEEK_SET)
+        _write_all(fd, data)
+        os.fsync(fd)
+    os.remove(pending)
+    return True
+
+
+def recover_csv(path=PATH):
+    """Completes or redoes the batch an interrupted append_csv left behind. Returns
+    whether there was one."""
+    if not os.path.exists(path + '.pending'):
+        return False
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _lock(fd)
+        return _recover(fd, path)
+    finally:
+        os.close(fd)
+
+
+def append_csv(df, path=PATH):
+    """Appends a frame to the CSV in one write, with a header only when the file is
+    empty. Safe against concurrent writers and crashes, see the module docstring."""
+    if df.empty:
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        _lock(fd)
+        _recover(fd, path)
+        size = os.fstat(fd).st_size
+        data = df.to_csv(header=size == 0, index=False).encode('utf-8')
+        _write_atomic(path + '.pending', str(size).encode('ascii') + b'\n' + data)
+        _write_all(fd, data)
+        os.fsync(fd)
+        os.remove(path + '.pending')
+    finally:
+        os.close(fd)
+
+
+class BufferedSampleWriter:
+    """A writer(df, path) for the collectors that batches samples before handing them to
+    'sink' (append_csv, or storage.write_samples with recover=storage.remove_partial).
+    Call flush_due() periodically and close() (or use it as a context manager) to write
+    what is still buffered. Thread safe."""
+
+    def __init__(self, path=PATH, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS, sink=append_csv,
+                 recover=recover_csv, clock=time.monotonic):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.sink = sink
+        self.clock = clock
+        self.buffers = {}
+        self.buffered = 0
+        self.oldest = None
+        self.written = 0
+        self._lock = threading.RLock()
+        if recover is not None and recover(path):
+            print('Recovered an interrupted write to {}'.format(path))
+
+    def __call__(self, df, path=None):
+        if df.empty:
+            return
+        with self._lock:
+            self.buffers.setdefault(path or self.path, []).append(df)
+            self.buffered += len(df)
+            self.oldest = self.clock() if self.oldest is None else self.oldest
+            if self.buffered >= self.flush_rows:
+                self.flush()
+            else:
+                self.flush_due()
+
+    def flush_due(self):
+        """Flushes when the oldest buffered sample has waited flush_seconds"""
+        with self._lock:
+            if self.oldest is not None and self.clock() - self.oldest >= self.flush_seconds:
+                self.flush()
+
+    def flush(self):
+        """Writes every buffered sample, one batch per path"""
+        with self._lock:
+            for path in list(self.buffers):
+                frames = self.buffers[path]
+                self.sink(pd.concat(frames, ignore_index=True), path)
+                self.written += sum(len(frame) for frame in frames)
+                del self.buffers[path]
+            self.buffered, self.oldest = 0, None
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
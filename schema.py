@@ -0,0 +1,65 @@
+"""The compact column types of the frames every analysis stage works on.
+
+After time_date_adjustments and clean_commute_columns a samples frame holds:
+
+    origin, destination, home, work  category, one code per row instead of a string
+    time                             datetime64, local time of the sample
+    slot                             int16 minute of the day the departure slot starts at
+    is_morning                       bool
+    duration_in_traffic              int16 whole minutes
+    distance                         float32 miles
+
+Aggregated tables are keyed by 'slot' as well and turned into 'HH:MM' labels only when
+plotted or printed (see slot_labels)."""
+
+import hashlib
+import numpy as np
+import pandas as pd
+
+ROUTE_COLUMNS = ['origin', 'destination', 'home', 'work']
+# Samples are stored in UTC and analyzed (and collected, see collector_daemon.SCHEDULES)
+# in the local time of their origin, addresses missing from TIMEZONES are in
+# DEFAULT_TIMEZONE
+DEFAULT_TIMEZONE = 'America/New_York'
+TIMEZONES = {}
+DTYPES = {'slot': 'int16', 'is_morning': 'bool', 'duration_in_traffic': 'int16', 'distance': 'float32'}
+
+
+def route_id(origin, destination):
+    """Short stable identifier for a route, names its storage partitions and identifies it
+    in query_service.py"""
+    key = '{}|{}'.format(origin, destination).encode('utf-8')
+    return hashlib.sha1(key).hexdigest()[:12]
+
+
+def minute_slots(times, minutes):
+    """Minute of the day of each timestamp, floored to a multiple of 'minutes'"""
+    return ((times.dt.hour * 60 + times.dt.minute) // minutes * minutes).astype(DTYPES['slot'])
+
+
+def slot_labels(slots):
+    """'HH:MM' labels for minute of the day slots"""
+    slots = np.asarray(slots, dtype=int)
+    return ['{:02d}:{:02d}'.format(slot // 60, slot % 60) for slot in slots]
+
+
+def route_categories(origin, destination):
+    """origin and destination as categoricals sharing one set of addresses, so codes can
+    be swapped between them"""
+    codes, addresses = pd.factorize(pd.concat([origin, destination], ignore_index=True), sort=True)
+    return [pd.Categorical.from_codes(part, addresses) for part in np.split(codes, [len(origin)])]
+
+
+def used_categories(df, columns=ROUTE_COLUMNS):
+    """'columns', categoricals over the same addresses, restricted to the addresses any of
+    them uses, so a slice of the rows does not carry (or pickle) every address"""
+    codes = np.unique(np.concatenate([df[column].cat.codes.values for column in columns]))
+    categories = df[columns[0]].cat.categories[codes[codes >= 0]]
+    return df.assign(**{column: df[column].cat.set_categories(categories) for column in columns})
+
+
+def footprint(df):
+    """Bytes per column (strings and other objects included) and per row"""
+    usage = df.memory_usage(deep=True, index=False)
+    return pd.DataFrame({'dtype': df.dtypes.astype(str), 'mb': usage / 1e6,
+                         'bytes_per_row': usage / max(len(df), 1)})
@@ -0,0 +1,128 @@
+"""Mergeable t-digest quantile sketches for commute durations.
+
+A digest keeps a few dozen weighted centroids instead of every raw duration, can be
+merged with digests built on other partitions or processes, and answers any percentile
+afterwards. Centroids are sized with the k1 scale function so the tails (perc_5,
+perc_95, perc_99) stay accurate: with the default compression of 100 the estimate for
+quantile q is typically within 0.5% of rank of the exact value and within 2% of rank in
+the worst case (see benchmarks.bench_sketch_accuracy and tests/test_sketches.py). min and
+max are exact."""
+
+import numpy as np
+
+COMPRESSION = 100
+
+
+def _scale(q, compression):
+    """k1 scale function, small clusters near q=0 and q=1"""
+    return compression / (2 * np.pi) * np.arcsin(2 * np.clip(q, 0, 1) - 1)
+
+
+def _compress(groups, means, weights, compression):
+    """Collapses centroids sorted by (group, mean) so each new centroid spans at most
+    one unit of the scale function within its group. Returns group ids, means, weights."""
+    totals = np.bincount(groups, weights=weights)
+    before = np.cumsum(weights) - weights
+    group_start = np.concatenate([[0], np.cumsum(totals)[:-1]])
+    q_left = (before - group_start[groups]) / totals[groups]
+    buckets = np.floor(_scale(q_left, compression) - _scale(0, compression)).astype(np.int64)
+    # Consecutive runs of the same (group, bucket) become one centroid
+    new_run = np.ones(len(groups), dtype=bool)
+    new_run[1:] = (groups[1:] != groups[:-1]) | (buckets[1:] != buckets[:-1])
+    run_ids = np.cumsum(new_run) - 1
+    run_weights = np.bincount(run_ids, weights=weights)
+    run_means = np.bincount(run_ids, weights=means * weights) / run_weights
+    return groups[new_run], run_means, run_weights
+
+
+class TDigest:
+    """Merging t-digest over a set of centroids"""
+
+    def __init__(self, means=(), weights=(), minimum=np.inf, maximum=-np.inf, compression=COMPRESSION):
+        self.means = np.asarray(means, dtype=float)
+        self.weights = np.asarray(weights, dtype=float)
+        self.min = minimum
+        self.max = maximum
+        self.compression = compression
+
+    @classmethod
+    def from_values(cls, values, compression=COMPRESSION):
+        values = np.sort(np.asarray(values, dtype=float))
+        if not len(values):
+            return cls(compression=compression)
+        groups = np.zeros(len(values), dtype=np.int64)
+        _, means, weights = _compress(groups, values, np.ones(len(values)), compression)
+        return cls(means, weights, values[0], values[-1], compression)
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def merge(self, other):
+        """A new digest summarising the values of both"""
+        means = np.concatenate([self.means, other.means])
+        weights = np.concatenate([self.weights, other.weights])
+        digest = TDigest(minimum=min(self.min, other.min), maximum=max(self.max, other.max),
+                         compression=self.compression)
+        if len(means):
+            order = np.argsort(means, kind='mergesort')
+            groups = np.zeros(len(means), dtype=np.int64)
+            _, digest.means, digest.weights = _compress(groups, means[order], weights[order],
+                                                        self.compression)
+        return digest
+
+    def update(self, values):
+        """A new digest with 'values' added"""
+        return self.merge(TDigest.from_values(values, self.compression))
+
+    def quantile(self, q):
+        """Estimated value at quantile q (a float or array in [0, 1])"""
+        if not len(self.means):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        total = self.count
+        mids = np.cumsum(self.weights) - self.weights / 2
+        xs = np.concatenate([[0], mids, [total]])
+        ys = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(q) * total, xs, ys)
+
+    def __repr__(self):
+        return 'TDigest(count={:g}, centroids={})'.format(self.count, len(self.means))
+
+
+def merge_digests(digests, compression=COMPRESSION):
+    """Merges any number of digests, e.g. one per partition or worker process. No digests
+    merge into an empty one."""
+    result = None
+    for digest in digests:
+        result = digest if result is None else result.merge(digest)
+    return TDigest(compression=compression) if result is None else result
+
+
+def rank_error(ordered, estimate, q):
+    """How far in rank an estimate of quantile q is from the exact quantile of the sorted
+    values 'ordered'. Tied values (whole minutes) span a range of ranks, the closest one
+    counts."""
+    low = np.searchsorted(ordered, estimate, side='left') / len(ordered)
+    high = np.searchsorted(ordered, estimate, side='right') / len(ordered)
+    return 0.0 if low <= q <= high else min(abs(low - q), abs(high - q))
+
+
+def group_digests(codes, values, compression=COMPRESSION):
+    """Builds one digest per group in a single vectorized pass. 'codes' are integer
+    group ids 0..n-1 (e.g. from pd.factorize); returns a list indexed by group id."""
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    groups, means, weights = _compress(codes, values, np.ones(len(values)), compression)
+    n_groups = codes.max() + 1 if len(codes) else 0
+    bounds = np.searchsorted(groups, np.arange(n_groups + 1))
+    value_bounds = np.searchsorted(codes, np.arange(n_groups + 1))
+    digests = []
+    for g in range(n_groups):
+        first, last = value_bounds[g], value_bounds[g + 1]
+        digest = TDigest(means[bounds[g]:bounds[g + 1]], weights[bounds[g]:bounds[g + 1]],
+                         values[first] if last > first else np.inf,
+                         values[last - 1] if last > first else -np.inf, compression)
+        digests.append(digest)
+    return digests
@@ -0,0 +1,135 @@
+"""Local stand-in for the Distance Matrix API to run the collectors against without a
+key or quota. Durations follow the synthetic rush hour profile, a share of requests can
+fail with HTTP 500 or OVER_QUERY_LIMIT and destinations containing 'nowhere' are
+NOT_FOUND. Run with 'python stand_in_server.py [--port PORT] [--error-rate R]
+[--limit-rate R]' and point MapsClient(url=...) at it, or with '--check' to exercise
+the cache, retries, rate limit and quota of maps_client.MapsClient once."""
+
+import json
+import time
+import zlib
+import random
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from synthetic_data import duration_text
+
+HOST = '127.0.0.1'
+PORT = 8051
+
+
+def element(origin, destination, when):
+    """A Distance Matrix element for a route, slower around 8:00 and 17:15"""
+    if 'nowhere' in destination.lower():
+        return {'status': 'NOT_FOUND'}
+    seed = zlib.crc32('{}|{}'.format(origin, destination).encode('utf-8'))
+    miles = 5 + seed % 25
+    hour = when.hour + when.minute / 60
+    peak = np.exp(-((hour - 8) / 0.9) ** 2) + np.exp(-((hour - 17.25) / 1.1) ** 2)
+    minutes = int(round(miles * 1.5 + miles * 0.7 * peak))
+    return {'status': 'OK',
+            'distance': {'text': '{:.1f} km'.format(miles * 1.609), 'value': int(miles * 1609)},
+            'duration': {'text': duration_text(np.array([int(miles * 1.5)]))[0], 'value': int(miles * 90)},
+            'duration_in_traffic': {'text': duration_text(np.array([minutes]))[0], 'value': minutes * 60}}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlsplit(self.path).query)
+        origins = query.get('origins', [''])[0].split('|')
+        destinations = query.get('destinations', [''])[0].split('|')
+        with server.lock:
+            server.stats['requests'] += 1
+            roll = server.random.random()
+        if roll < server.error_rate:
+            status, body = 500, {'error': 'stand-in server error'}
+        elif roll < server.error_rate + server.limit_rate:
+            status, body = 200, {'status': 'OVER_QUERY_LIMIT', 'rows': []}
+        elif 'key' not in query:
+            status, body = 200, {'status': 'REQUEST_DENIED', 'rows': []}
+        else:
+            with server.lock:
+                server.stats['elements'] += len(origins) * len(destinations)
+            when = datetime.datetime.now()
+            status, body = 200, {'status': 'OK', 'origin_addresses': origins, 'destination_addresses': destinations,
+                                 'rows': [{'elements': [element(o, d, when) for d in destinations]}
+                                          for o in origins]}
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host=HOST, port=PORT, error_rate=0.0, limit_rate=0.0, seed=0):
+    """A stand-in server, 'stats' counts the connections, requests and elements it answered"""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.error_rate, server.limit_rate = error_rate, limit_rate
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.stats = {'connections': 0, 'requests': 0, 'elements': 0}
+    return server
+
+
+def start(**kwargs):
+    """Serves a stand-in server from a daemon thread, returns it and its url"""
+    server = make_server(port=0, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://{}:{}/'.format(*server.server_address)
+
+
+def check(routes=30):
+    """Collects the same routes twice against a flaky stand-in and prints what the
+    client saved, retried, throttled and refused"""
+    from maps_client import MapsClient
+    server, url = start(error_rate=0.2, limit_rate=0.1)
+    routes = [('{} Home St'.format(num), '{} Work Ave'.format(num)) for num in range(routes)]
+    routes.append(('1 Home St', 'Nowhere'))
+    client = MapsClient('stand-in', url=url, qps=20, burst=5, daily_quota=50, backoff_seconds=0.05)
+    when = datetime.datetime.now()
+    start_time = time.perf_counter()
+    for run in range(2):
+        frame = client.commute_times(routes, when)
+        print('Run {}: {} samples'.format(run + 1, len(frame)))
+    frame = client.commute_times(routes, when + datetime.timedelta(minutes=10))
+    print('Next departure bucket: {} samples'.format(len(frame)))
+    print('Took {:.2f}s'.format(time.perf_counter() - start_time))
+    print('Client:', json.dumps(client.metrics_summary()))
+    print('Server:', json.dumps(server.stats))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with HTTP 500')
+    parser.add_argument('--limit-rate', type=float, default=0.0, help='share answered OVER_QUERY_LIMIT')
+    parser.add_argument('--check', action='store_true', help='exercise maps_client against a stand-in and exit')
+    args = parser.parse_args()
+    if args.check:
+        check()
+    else:
+        server = make_server(args.host, args.port, args.error_rate, args.limit_rate)
+        print('Stand-in Distance Matrix API on http://{}:{}/'.format(*server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
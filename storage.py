@@ -0,0 +1,224 @@
+"""Date and route partitioned parquet storage for collected commute samples.
+Samples live under root/date=YYYY-MM-DD/route=<route id>/part-*.parquet so readers only
+open the partitions that match the dates and routes they ask for.
+
+compact swaps a partition's files for one merged file atomically: before publishing the
+merged file it records the files it replaces in the partition's '.compaction.json', and
+readers skip those files once the merged one exists. The replaced files and the record
+are removed afterwards, by compact itself or, after a crash, by the next compact or
+remove_partial."""
+
+import os
+import json
+import glob
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schema import route_id
+from maps_client import COLUMNS
+
+STORE_PATH = './commute_store'
+CSV_CHUNKSIZE = 1000000
+# Temporary part files older than this were left behind by a writer that crashed
+STALE_SECONDS = 3600
+# Rows per frame of iter_samples
+CHUNKSIZE = 200000
+COMPACTION = '.compaction.json'
+
+
+def _partition_dir(root, date, route):
+    return os.path.join(root, 'date={}'.format(date), 'route={}'.format(route))
+
+
+def _write_tmp(df, directory):
+    """Writes one parquet file under a hidden temporary name, returns it and the final name"""
+    os.makedirs(directory, exist_ok=True)
+    name = 'part-{}-{}.parquet'.format(time.time_ns(), uuid.uuid4().hex[:8])
+    tmp = os.path.join(directory, '.' + name + '.tmp')
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    pq.write_table(table, tmp)
+    return tmp, name
+
+
+def _write_part(df, directory):
+    """Writes one parquet file, visible under its final name only once complete"""
+    tmp, name = _write_tmp(df, directory)
+    os.replace(tmp, os.path.join(directory, name))
+
+
+def write_samples(df, root=STORE_PATH):
+    """Writes a frame of samples (as produced by the collector) into the store,
+    one new file per date/route partition touched"""
+    if df.empty:
+        return
+    df = df.copy()
+    df['time'] = pd.to_datetime(df['time'])
+    dates = df['time'].dt.strftime('%Y-%m-%d')
+    routes = [route_id(o, d) for o, d in zip(df['origin'], df['destination'])]
+    for (date, route), part in df.groupby([dates, routes]):
+        _write_part(part, _partition_dir(root, date, route))
+
+
+def _compaction(directory):
+    """The merged file and replaced files of a compaction of 'directory' still in
+    progress (or interrupted), None when there is none"""
+    try:
+        with open(os.path.join(directory, COMPACTION)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _finish_compaction(directory, stale_seconds=STALE_SECONDS):
+    """Removes the files a published compaction replaced, and the record of a compaction
+    that never published its merged file once it is stale. Returns whether no compaction
+    is left in progress."""
+    record = _compaction(directory)
+    if record is None:
+        return True
+    path = os.path.join(directory, COMPACTION)
+    if os.path.exists(os.path.join(directory, record['merged'])):
+        for name in record['replaced']:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    elif os.path.getmtime(path) >= time.time() - stale_seconds:
+        return False
+    os.remove(path)
+    return True
+
+
+def remove_partial(root=STORE_PATH, stale_seconds=STALE_SECONDS):
+    """Deletes the temporary files of writes that never finished and completes
+    interrupted compactions, returns how many temporary files there were"""
+    cutoff = time.time() - stale_seconds
+    stale = [path for path in glob.glob(os.path.join(root, 'date=*', 'route=*', '.part-*.tmp'))
+             if os.path.getmtime(path) < cutoff]
+    for path in stale:
+        os.remove(path)
+    for path in glob.glob(os.path.join(root, 'date=*', 'route=*', COMPACTION)):
+        _finish_compaction(os.path.dirname(path), stale_seconds)
+    return len(stale)
+
+
+def partitions(root=STORE_PATH, start=None, end=None, routes=None):
+    """Partition directories within the date range (inclusive) and routes given.
+    'routes' is a list of (origin, destination) tuples."""
+    start = None if start is None else pd.Timestamp(start).strftime('%Y-%m-%d')
+    end = None if end is None else pd.Timestamp(end).strftime('%Y-%m-%d')
+    ids = None if routes is None else {route_id(o, d) for o, d in routes}
+    found = []
+    for date_dir in sorted(glob.glob(os.path.join(root, 'date=*'))):
+        date = os.path.basename(date_dir)[len('date='):]
+        if (start and date < start) or (end and date > end):
+            continue
+        for route_dir in sorted(glob.glob(os.path.join(date_dir, 'route=*'))):
+            if ids is None or os.path.basename(route_dir)[len('route='):] in ids:
+                found.append(route_dir)
+    return found
+
+
+def _part_files(directory):
+    """The files holding the partition's rows, without those a published compaction replaced"""
+    files = sorted(glob.glob(os.path.join(directory, 'part-*.parquet')))
+    record = _compaction(directory)
+    if record is not None and os.path.join(directory, record['merged']) in files:
+        replaced = {os.path.join(directory, name) for name in record['replaced']}
+        files = [path for path in files if path not in replaced]
+    return files
+
+
+def _partition_tables(directory, columns=None):
+    """The tables of one partition. A file removed by a compaction finishing meanwhile
+    means the merged file is published, so the partition is listed again."""
+    try:
+        return [pq.read_table(path, columns=columns) for path in _part_files(directory)]
+    except FileNotFoundError:
+        return [pq.read_table(path, columns=columns) for path in _part_files(directory)]
+
+
+def _part_tables(directories, columns=None):
+    return [table for directory in directories for table in _partition_tables(directory, columns)]
+
+
+def _to_frame(tables, start=None, end=None, columns=None):
+    """One time sorted frame of the rows of 'tables' between start and end, with the
+    sample columns when there are none"""
+    if not tables:
+        return pd.DataFrame(columns=columns or COLUMNS)
+    df = pa.concat_tables(tables).to_pandas()
+    if 'time' in df and (start is not None or end is not None):
+        keep = pd.Series(True, index=df.index)
+        if start is not None:
+            keep &= df['time'] >= pd.Timestamp(start)
+        if end is not None:
+            keep &= df['time'] < pd.Timestamp(end).normalize() + pd.Timedelta(1, unit='D')
+        df = df.loc[keep]
+    return df.sort_values('time').reset_index(drop=True) if 'time' in df else df
+
+
+def read_samples(root=STORE_PATH, start=None, end=None, routes=None, columns=None):
+    """Loads the samples between start and end for the given routes, only opening
+    the partitions that can contain them"""
+    return _to_frame(_part_tables(partitions(root, start, end, routes), columns), start, end, columns)
+
+
+def iter_samples(root=STORE_PATH, start=None, end=None, routes=None, columns=None, chunksize=CHUNKSIZE):
+    """read_samples in frames of whole partitions, each combining partitions until it
+    holds at least 'chunksize' rows (the last one may hold fewer), for histories that do
+    not fit in memory at once"""
+    tables, rows = [], 0
+    for directory in partitions(root, start, end, routes):
+        for table in _partition_tables(directory, columns):
+            tables.append(table)
+            rows += table.num_rows
+        if rows >= chunksize:
+            df = _to_frame(tables, start, end, columns)
+            tables, rows = [], 0
+            if len(df):
+                yield df
+    df = _to_frame(tables, start, end, columns)
+    if len(df):
+        yield df
+
+
+def compact(root=STORE_PATH, min_files=2):
+    """Merges the small files of each partition into a single time sorted file, see the
+    module docstring. Partitions another compaction is working on are skipped. Returns
+    the number of partitions compacted."""
+    compacted = 0
+    for directory in partitions(root):
+        if not _finish_compaction(directory):
+            continue
+        files = _part_files(directory)
+        if len(files) < min_files:
+            continue
+        df = pa.concat_tables([pq.read_table(path) for path in files]).to_pandas()
+        tmp, name = _write_tmp(df.sort_values('time'), directory)
+        record = os.path.join(directory, COMPACTION)
+        with open(record + '.tmp', 'w') as f:
+            json.dump({'merged': name, 'replaced': [os.path.basename(path) for path in files]}, f)
+        os.replace(record + '.tmp', record)
+        # The swap: from here on readers take the merged file instead of the replaced ones
+        os.replace(tmp, os.path.join(directory, name))
+        _finish_compaction(directory)
+        compacted += 1
+    return compacted
+
+
+def import_csv(csv_loc='./commute_info.csv', root=STORE_PATH, chunksize=CSV_CHUNKSIZE):
+    """Moves an existing commute_info.csv into the store in a single pass over the
+    file and compacts the result. Returns the number of rows imported."""
+    rows = 0
+    for chunk in pd.read_csv(csv_loc, chunksize=chunksize):
+        write_samples(chunk, root)
+        rows += len(chunk)
+    compact(root)
+    return rows
+
+
+if __name__ == '__main__':
+    print("Imported {} rows into {}".format(import_csv(), STORE_PATH))
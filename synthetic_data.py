@@ -0,0 +1,117 @@
+"""Generates realistic commute samples in the exact schema trip_duration_retriever.py
+writes (google style text durations and distances, origin/destination addresses and UTC
+timestamps) for testing and benchmarking without collecting real data.
+Run with 'python synthetic_data.py routes days [interval] [path]'."""
+
+import sys
+import numpy as np
+import pandas as pd
+
+KM_PER_MILE = 1.609
+COLUMNS = ['distance', 'duration_in_traffic', 'destination', 'origin', 'time']
+TIMEZONE = 'America/New_York'
+# Local collection hours, matching commute_analyzer.HOURS_OF_INTEREST
+MORNING_HOURS = [6, 7, 8, 9]
+EVENING_HOURS = [15, 16, 17, 18]
+STREETS = ['Main St', 'Elm St', 'Washington St', 'Beacon St', 'Centre St', 'Highland Ave',
+           'Massachusetts Ave', 'Commonwealth Ave', 'Summer St', 'Pleasant St']
+TOWNS = [('Boston', '02116'), ('Newton', '02458'), ('Waltham', '02451'), ('Burlington', '01803'),
+         ('Cambridge', '02139'), ('Lexington', '02421'), ('Quincy', '02169'), ('Woburn', '01801')]
+
+
+def _plural(count, unit):
+    return '{} {}{}'.format(count, unit, '' if count == 1 else 's')
+
+
+def duration_text(minutes):
+    """Google's duration text ('45 mins', '1 hour', '1 hour 5 mins') for an array of whole minutes"""
+    lookup = []
+    for m in range(minutes.max() + 1):
+        hours = _plural(m // 60, 'hour') if m >= 60 else ''
+        mins = _plural(m % 60, 'min') if m % 60 or m < 60 else ''
+        lookup.append(' '.join(part for part in [hours, mins] if part))
+    return np.array(lookup)[minutes]
+
+
+def distance_text(kilometers):
+    """Google's distance text ('12.3 km') for an array of kilometers"""
+    codes, uniques = pd.factorize(np.round(kilometers, 1))
+    return np.array(['{:.1f} km'.format(km) for km in uniques])[codes]
+
+
+def make_routes(routes, seed=0):
+    """Home/work addresses, typical free flow minutes, rush hour delay and 2-3 alternative
+    route distances for each route"""
+    rng = np.random.RandomState(seed)
+    made = []
+    for num in range(routes):
+        home_town, work_town = rng.choice(len(TOWNS), 2, replace=False)
+        miles = rng.uniform(5, 30)
+        made.append({'home': '{} {}, {}, MA {}, USA'.format(num + 1, STREETS[rng.randint(len(STREETS))],
+                                                             *TOWNS[home_town]),
+                     'work': '{} {}, {}, MA {}, USA'.format(100 + num, STREETS[rng.randint(len(STREETS))],
+                                                             *TOWNS[work_town]),
+                     'free_flow': miles * rng.uniform(1.3, 1.8),
+                     'delay': miles * rng.uniform(0.4, 1.0),
+                     'distances': miles * KM_PER_MILE * rng.uniform(0.95, 1.1, rng.randint(2, 4))})
+    return made
+
+
+def sample_times(days, interval, start):
+    """UTC sample times every 'interval' minutes during the local collection hours"""
+    local_days = pd.date_range(pd.Timestamp(start).normalize(), periods=days, freq='D')
+    offsets = [pd.Timedelta(hours=hour, minutes=minute) for hour in MORNING_HOURS + EVENING_HOURS
+               for minute in range(0, 60, interval)]
+    local = (local_days.values.reshape(-1, 1) + np.array(offsets, dtype='timedelta64[ns]')).ravel()
+    times = pd.DatetimeIndex(local).tz_localize(TIMEZONE, ambiguous='NaT', nonexistent='NaT')
+    return times[times.notnull()].tz_convert('UTC').tz_localize(None)
+
+
+def generate_samples(routes=1, days=30, interval=5, start='2019-01-07', seed=0, route_info=None):
+    """A frame of collected samples for every route over 'days' days"""
+    rng = np.random.RandomState(seed)
+    route_info = route_info or make_routes(routes, seed)
+    utc = sample_times(days, interval, start)
+    local = utc.tz_localize('UTC').tz_convert(TIMEZONE)
+    hour = (local.hour + local.minute / 60).values
+    morning = hour < 12
+    # Rush hour peaks at 8:00 and 17:15, lighter on Fridays
+    peak = np.where(morning, np.exp(-((hour - 8) / 0.9) ** 2), np.exp(-((hour - 17.25) / 1.1) ** 2))
+    peak = peak * np.where(local.dayofweek == 4, 0.7, 1.0) * np.where(local.dayofweek >= 5, 0.3, 1.0)
+    frames = []
+    for route in route_info:
+        noise = rng.lognormal(0, 0.12, len(utc))
+        minutes = np.maximum(1, np.round((route['free_flow'] + route['delay'] * peak) * noise)).astype(int)
+        choice = rng.randint(len(route['distances']), size=len(utc))
+        frames.append(pd.DataFrame({'distance': distance_text(route['distances'][choice]),
+                                    'duration_in_traffic': duration_text(minutes),
+                                    'destination': np.where(morning, route['work'], route['home']),
+                                    'origin': np.where(morning, route['home'], route['work']),
+                                    'time': utc}))
+    return pd.concat(frames, ignore_index=True).sort_values('time', kind='mergesort')[COLUMNS]
+
+
+def samples_per_day(interval=5):
+    return len(MORNING_HOURS + EVENING_HOURS) * 60 // interval
+
+
+def write_samples_csv(path, routes=1, days=30, interval=5, start='2019-01-07', seed=0, days_per_chunk=30):
+    """Writes generated samples to a CSV a block of days at a time so histories larger
+    than memory can be produced. Returns the number of rows written."""
+    route_info = make_routes(routes, seed)
+    rows = 0
+    for num, first in enumerate(range(0, days, days_per_chunk)):
+        chunk = generate_samples(days=min(days_per_chunk, days - first), interval=interval,
+                                 start=pd.Timestamp(start) + pd.Timedelta(days=first),
+                                 seed=seed + num + 1, route_info=route_info)
+        chunk.to_csv(path, mode='w' if num == 0 else 'a', header=num == 0, index=False)
+        rows += len(chunk)
+    return rows
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    path = args[3] if len(args) > 3 else './commute_info.csv'
+    written = write_samples_csv(path, routes=int(args[0]) if args else 1, days=int(args[1]) if len(args) > 1 else 30,
+                                interval=int(args[2]) if len(args) > 2 else 5)
+    print("Wrote {:,} samples to {}".format(written, path))
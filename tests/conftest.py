@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stand_in_server  # noqa: E402
+
+
+@pytest.fixture
+def stand_in():
+    """A stand-in Distance Matrix server on a free port and its url"""
+    server, url = stand_in_server.start()
+    yield server, url
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,17 @@
+from commute_analyzer import adjust_samples, clean_commute_columns, analyze_route, route_summary
+from synthetic_data import generate_samples
+
+
+def test_a_route_sampled_one_way_keeps_its_tables():
+    raw = generate_samples(routes=3, days=10)
+    home, work = raw['origin'].iloc[0], raw['destination'].iloc[0]
+    raw = raw.loc[~((raw['origin'] == work) & (raw['destination'] == home))]
+    df = clean_commute_columns(adjust_samples(raw))[0]
+    tables = analyze_route(df)
+    assert len(tables) == 3
+    one_way = [route for route in tables.values() if route['evening'].empty]
+    assert len(one_way) == 1
+    assert not one_way[0]['morning'].empty
+    assert one_way[0]['merged'].empty and one_way[0]['windows'].empty
+    summary = route_summary(tables)
+    assert len(summary) == 3 and summary['best_evening'].isna().sum() == 1
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+from commute_analyzer import adjust_samples, clean_commute_columns, time_aggregator, daily_averages, distance_variation
+from incremental import empty_state, update_state, state_tables
+from synthetic_data import generate_samples
+
+
+@pytest.fixture(scope='module')
+def raw():
+    return generate_samples(routes=3, days=10).reset_index(drop=True)
+
+
+def assert_matches_full_recompute(state, raw):
+    df = clean_commute_columns(adjust_samples(raw.copy()))[0]
+    evening, morning = time_aggregator(df)
+    expected = [evening, morning, daily_averages(df)] + distance_variation(df)
+    folded = state_tables(state)
+    folded = list(folded[:3]) + folded[3]
+    for table, full in zip(folded, expected):
+        pd.testing.assert_frame_equal(table.reset_index(drop=True), full.reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False)
+    for table, full in zip(folded[3:], expected[3:]):
+        assert table.index.tolist() == full.index.tolist()
+
+
+def test_a_csv_read_partway_through_a_timestamp_is_folded_once(raw, tmp_path):
+    path = str(tmp_path / 'commute_info.csv')
+    # Split between two routes sampled at the same time
+    split = next(row for row in range(len(raw) // 2, len(raw)) if raw['time'][row] == raw['time'][row - 1])
+    raw.iloc[:split].to_csv(path, index=False)
+    state, first = update_state(empty_state(), path, chunksize=1000)
+    raw.to_csv(path, index=False)
+    state, second = update_state(state, path, chunksize=1000)
+    assert (first, second) == (split, len(raw) - split)
+    assert_matches_full_recompute(state, raw)
+
+
+def test_a_route_published_behind_the_others_is_folded(raw, tmp_path):
+    pytest.importorskip('pyarrow')
+    import storage
+    root = str(tmp_path / 'store')
+    half = raw['time'] < raw['time'].iloc[len(raw) // 2]
+    storage.write_samples(raw.loc[half], root)
+    rest = raw.loc[~half]
+    late = (rest['origin'] == rest['origin'].iloc[0]) & (rest['destination'] == rest['destination'].iloc[0])
+    storage.write_samples(rest.loc[~late], root)
+    state, _ = update_state(empty_state(), root, chunksize=1000)
+    storage.write_samples(rest.loc[late], root)
+    state, _ = update_state(state, root, chunksize=1000)
+    assert_matches_full_recompute(state, raw)
+
+
+@pytest.mark.parametrize('engine', ['exact', 'sketch'])
+def test_no_weekday_samples_give_empty_tables(raw, tmp_path, engine):
+    path = str(tmp_path / 'commute_info.csv')
+    raw.loc[raw['time'].dt.dayofweek >= 5].to_csv(path, index=False)
+    state, _ = update_state(empty_state(engine), path, chunksize=100)
+    evening, morning, _, distances = state_tables(state)
+    assert evening.empty and morning.empty
+    assert all(table.empty for table in distances)
+    assert ('duration_in_traffic', 'median') in evening
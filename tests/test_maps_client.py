@@ -0,0 +1,99 @@
+import datetime
+import requests
+import maps_client
+from maps_client import (MAX_DESTINATIONS, MAX_ELEMENTS, MAX_ORIGINS, MapsClient, distance_matrix, route_batches,
+                         unpack_matrix)
+
+WHEN = datetime.datetime(2019, 4, 1, 12, 0)
+
+
+def covered(routes, batches):
+    return all(any(origin in origins and destination in destinations for origins, destinations in batches)
+               for origin, destination in routes)
+
+
+def within_limits(batches):
+    return all(len(origins) <= MAX_ORIGINS and len(destinations) <= MAX_DESTINATIONS and
+               len(origins) * len(destinations) <= MAX_ELEMENTS for origins, destinations in batches)
+
+
+def test_route_batches_packs_shared_destinations():
+    routes = [('home {}'.format(num), 'work') for num in range(10)]
+    assert route_batches(routes) == [(['home {}'.format(num) for num in range(10)], ['work'])]
+
+
+def test_route_batches_respects_request_limits():
+    routes = [('home {}'.format(num), 'work') for num in range(60)]
+    routes += [('home 0', 'site {}'.format(num)) for num in range(30)]
+    batches = route_batches(routes)
+    assert covered(routes, batches)
+    assert within_limits(batches)
+    assert len(batches) <= 4
+
+
+def test_route_batches_without_waste_keeps_unrelated_destinations_apart():
+    routes = [('a', 'x'), ('b', 'y'), ('c', 'x')]
+    batches = route_batches(routes, max_waste=0)
+    assert sorted(batches) == [(['a', 'c'], ['x']), (['b'], ['y'])]
+    merged = route_batches(routes)
+    assert covered(routes, merged)
+    assert len(merged) == 1
+
+
+def test_route_batches_deduplicates_routes():
+    assert route_batches([('a', 'x'), ('a', 'x')]) == [(['a'], ['x'])]
+
+
+def element(minutes, status='OK'):
+    if status != 'OK':
+        return {'status': status}
+    return {'status': 'OK', 'distance': {'text': '10.0 km', 'value': 10000},
+            'duration_in_traffic': {'text': '{} mins'.format(minutes), 'value': minutes * 60}}
+
+
+def matrix(origins, destinations, elements):
+    return {'status': 'OK', 'origin_addresses': ['{} (formatted)'.format(o) for o in origins],
+            'destination_addresses': ['{} (formatted)'.format(d) for d in destinations],
+            'rows': [{'elements': row} for row in elements]}
+
+
+def test_unpack_matrix_records_wanted_routes_only():
+    origins, destinations = ['a', 'b'], ['x', 'y']
+    result = matrix(origins, destinations, [[element(10), element(11)], [element(12), element(13)]])
+    wanted = {('a', 'x'), ('b', 'y')}
+    records = unpack_matrix(result, origins, destinations, wanted, WHEN)
+    assert [(r['origin'], r['destination'], r['duration_in_traffic']) for r in records] == [
+        ('a (formatted)', 'x (formatted)', '10 mins'), ('b (formatted)', 'y (formatted)', '13 mins')]
+    assert all(r['time'] == WHEN and r['distance'] == '10.0 km' for r in records)
+    assert wanted == set()
+
+
+def test_unpack_matrix_skips_unroutable_and_already_unpacked_routes():
+    origins, destinations = ['a'], ['x', 'nowhere']
+    result = matrix(origins, destinations, [[element(10), element(0, 'NOT_FOUND')]])
+    wanted = {('a', 'x'), ('a', 'nowhere')}
+    assert len(unpack_matrix(result, origins, destinations, wanted, WHEN)) == 1
+    assert unpack_matrix(result, origins, destinations, wanted, WHEN) == []
+
+
+def test_shared_session_reuses_one_connection(stand_in, monkeypatch):
+    server, url = stand_in
+    monkeypatch.setattr(maps_client, '_SESSION', None)
+    for _ in range(20):
+        assert distance_matrix(['a'], ['x'], 'key', url=url)['status'] == 'OK'
+    assert server.stats['requests'] == 20
+    assert server.stats['connections'] == 1
+
+
+def test_batched_collection_counts_requests_and_latency(stand_in):
+    server, url = stand_in
+    routes = [('home {}'.format(num), 'work') for num in range(30)] + [('home 0', 'gym')]
+    client = MapsClient('key', url=url, session=requests.Session(), qps=1000, burst=1000)
+    frame = client.commute_times(routes, WHEN)
+    assert len(frame) == len(routes)
+    assert server.stats['requests'] == client.metrics_summary()['api_requests'] == 3
+    assert server.stats['elements'] == len(routes)
+    assert server.stats['connections'] == 1
+    assert len(client.latency) == 3
+    summary = client.metrics_summary()
+    assert 0 < summary['latency_p50_ms'] <= summary['latency_p99_ms']
@@ -0,0 +1,112 @@
+import datetime
+import threading
+import pytest
+import requests
+import stand_in_server
+from maps_client import DailyQuota, MapsClient, QuotaExceeded, TokenBucket
+
+WHEN = datetime.datetime(2019, 4, 1, 12, 0)
+ROUTES = [('{} Home St'.format(num), '{} Work Ave'.format(num)) for num in range(10)]
+
+
+def client_for(url, **kwargs):
+    kwargs = dict(dict(qps=1000, burst=1000, backoff_seconds=0.001), **kwargs)
+    return MapsClient('stand-in', url=url, session=requests.Session(), **kwargs)
+
+
+def test_repeated_routes_are_served_from_the_cache(stand_in):
+    server, url = stand_in
+    client = client_for(url)
+    first = client.commute_times(ROUTES, WHEN)
+    again = client.commute_times(ROUTES, WHEN + datetime.timedelta(minutes=1))
+    assert len(first) == len(again) == len(ROUTES)
+    summary = client.metrics_summary()
+    assert summary['cache_hits'] == summary['cache_misses'] == len(ROUTES)
+    assert server.stats['requests'] == summary['api_requests'] == len(ROUTES)
+
+
+def test_the_next_departure_bucket_is_requested_again(stand_in):
+    server, url = stand_in
+    client = client_for(url)
+    client.commute_times(ROUTES, WHEN)
+    client.commute_times(ROUTES, WHEN + datetime.timedelta(minutes=10))
+    assert client.metrics_summary()['cache_hits'] == 0
+    assert server.stats['requests'] == 2 * len(ROUTES)
+
+
+def test_failed_requests_are_retried_and_counted_once():
+    server, url = stand_in_server.start(error_rate=0.3, limit_rate=0.2, seed=3)
+    try:
+        client = client_for(url, max_retries=10)
+        frame = client.commute_times(ROUTES, WHEN)
+    finally:
+        server.shutdown()
+        server.server_close()
+    summary = client.metrics_summary()
+    assert len(frame) == len(ROUTES)
+    assert summary['api_retries'] > 0
+    assert summary['api_requests'] == server.stats['requests'] == len(ROUTES) + summary['api_retries']
+    # Only answered requests count against the quota
+    assert summary['quota_used'] == server.stats['elements'] == len(ROUTES)
+
+
+def test_requests_beyond_the_daily_quota_are_refused(stand_in):
+    server, url = stand_in
+    client = client_for(url, daily_quota=4)
+    frame = client.commute_times(ROUTES, WHEN)
+    summary = client.metrics_summary()
+    assert len(frame) == 4
+    assert summary['quota_rejected'] == len(ROUTES) - 4
+    assert summary['quota_remaining'] == 0
+    assert server.stats['requests'] == 4
+
+
+def test_quota_file_is_shared_between_clients(tmp_path):
+    path = str(tmp_path / 'quota.json')
+    today = lambda: datetime.date(2019, 4, 1)  # noqa: E731
+    first, second = DailyQuota(10, path, today), DailyQuota(10, path, today)
+    first.reserve(4)
+    second.reserve(4)
+    with pytest.raises(QuotaExceeded):
+        first.reserve(4)
+    second.release(4)
+    first.reserve(4)
+    assert DailyQuota(10, path, today).remaining == 2
+    tomorrow = DailyQuota(10, path, lambda: datetime.date(2019, 4, 2))
+    assert tomorrow.remaining == 10
+
+
+def test_concurrent_reservations_never_overspend(tmp_path):
+    path = str(tmp_path / 'quota.json')
+    granted = []
+
+    def spend():
+        quota = DailyQuota(100, path)
+        for _ in range(50):
+            try:
+                quota.reserve(1)
+                granted.append(1)
+            except QuotaExceeded:
+                pass
+
+    threads = [threading.Thread(target=spend) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(granted) == 100
+    assert DailyQuota(100, path).remaining == 0
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    now, slept = [0.0], []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=10, capacity=2, clock=lambda: now[0], sleep=sleep)
+    waits = [bucket.acquire() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2:] == pytest.approx([0.1, 0.1])
+    assert sum(slept) == pytest.approx(0.2)
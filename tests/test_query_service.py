@@ -0,0 +1,45 @@
+import pytest
+from commute_analyzer import adjust_samples, clean_commute_columns, build_aggregates
+from query_service import AggregateIndex
+from schema import route_id
+from synthetic_data import generate_samples
+
+
+@pytest.fixture(scope='module')
+def index():
+    df = clean_commute_columns(adjust_samples(generate_samples(days=10)))[0]
+    return AggregateIndex(build_aggregates(df))
+
+
+@pytest.fixture(scope='module')
+def route(index):
+    return next(iter(index.routes.values()))
+
+
+def test_best_returns_the_k_fastest_slots(index, route):
+    best = index.best({'home': route['home'], 'work': route['work'], 'k': '2'})
+    assert len(best) == 2 and best[0]['mean'] <= best[1]['mean']
+    assert index.best({'route': route['route'], 'k': '2'}) == best
+    assert route['route'] == route_id(route['home'], route['work'])
+
+
+@pytest.mark.parametrize('params', [{'home': 'a'}, {'work': 'b'}, {}])
+def test_a_route_needs_an_id_or_both_addresses(index, params):
+    with pytest.raises(ValueError):
+        index.best(params)
+
+
+@pytest.mark.parametrize('k', ['-1', '0', 'x'])
+def test_k_must_be_a_positive_integer(index, route, k):
+    with pytest.raises(ValueError):
+        index.best({'route': route['route'], 'k': k})
+    with pytest.raises(ValueError):
+        index.window({'route': route['route'], 'k': k})
+
+
+def test_aggregates_of_no_samples_are_empty():
+    df = clean_commute_columns(adjust_samples(generate_samples(days=10).iloc[:0]))[0]
+    aggregates = build_aggregates(df)
+    assert aggregates['slots'].empty and aggregates['windows'].empty
+    assert 'mean' in aggregates['slots'] and 'total' in aggregates['windows']
+    assert AggregateIndex(aggregates).routes == {}
@@ -0,0 +1,10 @@
+import gzip
+from response_archive import _members
+
+
+def test_members_stop_at_a_truncated_member(tmp_path):
+    path = str(tmp_path / 'responses-2019-04-01.jsonl.gz')
+    last = gzip.compress(b'{"c": 3}\n')
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(b'{"a": 1}\n') + gzip.compress(b'{"b": 2}\n') + last[:len(last) // 2])
+    assert list(_members(path)) == [b'{"a": 1}\n', b'{"b": 2}\n']
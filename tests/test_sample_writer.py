@@ -0,0 +1,69 @@
+import os
+import pandas as pd
+import pytest
+from sample_writer import append_csv, recover_csv, BufferedSampleWriter
+
+
+def samples(start, rows=3):
+    return pd.DataFrame({'distance': '10.0 km', 'duration_in_traffic': '25 mins', 'destination': 'work',
+                         'origin': 'home', 'time': pd.date_range('2019-04-01 12:00', periods=rows, freq='5min')
+                         + pd.Timedelta(start, unit='h')})
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'commute_info.csv')
+    append_csv(samples(0), path)
+    return path
+
+
+def interrupted_append(path, written=None):
+    """append_csv of a second batch stopped after 'written' of its bytes (all of them by
+    default) reached the file"""
+    size = os.path.getsize(path)
+    data = samples(1).to_csv(header=False, index=False).encode('utf-8')
+    with open(path + '.pending', 'wb') as f:
+        f.write(str(size).encode('ascii') + b'\n' + data)
+    with open(path, 'ab') as f:
+        f.write(data[:written])
+
+
+def assert_holds_both_batches(path):
+    assert not os.path.exists(path + '.pending')
+    expected = pd.concat([samples(0), samples(1)], ignore_index=True)
+    pd.testing.assert_frame_equal(pd.read_csv(path, parse_dates=['time']), expected)
+
+
+def test_a_torn_batch_is_written_again(path):
+    interrupted_append(path, written=40)
+    assert recover_csv(path)
+    assert_holds_both_batches(path)
+
+
+def test_a_written_batch_whose_pending_file_remains_is_not_duplicated(path):
+    interrupted_append(path)
+    before = os.path.getsize(path)
+    assert recover_csv(path)
+    assert os.path.getsize(path) == before
+    assert_holds_both_batches(path)
+
+
+def test_appending_recovers_first(path):
+    interrupted_append(path, written=40)
+    append_csv(samples(2), path)
+    assert not os.path.exists(path + '.pending')
+    assert len(pd.read_csv(path)) == 9
+    assert not recover_csv(path)
+
+
+def test_buffered_samples_are_written_once_due(tmp_path):
+    path, now = str(tmp_path / 'commute_info.csv'), [0]
+    writer = BufferedSampleWriter(path, flush_rows=5, flush_seconds=60, clock=lambda: now[0])
+    writer(samples(0))
+    assert not os.path.exists(path)
+    now[0] = 60
+    writer.flush_due()
+    assert len(pd.read_csv(path)) == 3
+    writer(samples(1))
+    writer(samples(2))
+    assert len(pd.read_csv(path)) == 9 and writer.written == 9
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sketches import TDigest, group_digests, merge_digests, rank_error
+from incremental import fold_digests
+
+QUANTILES = [0.05, 0.5, 0.9, 0.95, 0.99]
+
+
+def durations(rows, seed=0):
+    """Skewed whole minute durations like google's"""
+    return np.round(np.random.RandomState(seed).lognormal(3.7, 0.3, rows))
+
+
+@pytest.mark.parametrize('partitions', [1, 10])
+def test_percentiles_stay_within_the_rank_error_bound(partitions):
+    values = durations(200000)
+    digest = merge_digests(TDigest.from_values(part) for part in np.array_split(values, partitions))
+    ordered = np.sort(values)
+    errors = [rank_error(ordered, digest.quantile(q), q) for q in QUANTILES]
+    assert max(errors) < 0.02
+    assert np.mean(errors) < 0.005
+    assert digest.count == len(values)
+    assert (digest.min, digest.max) == (ordered[0], ordered[-1])
+    assert len(digest.means) < 200
+
+
+def test_merging_no_digests_gives_an_empty_one():
+    digest = merge_digests([])
+    assert digest.count == 0
+    assert np.isnan(digest.quantile(0.5))
+    assert merge_digests(iter([TDigest.from_values([1, 2, 3])])).count == 3
+
+
+def test_group_digests_match_digests_of_each_group():
+    values = durations(30000)
+    codes = np.arange(len(values)) % 3
+    for code, digest in enumerate(group_digests(codes, values)):
+        expected = TDigest.from_values(values[codes == code])
+        assert digest.count == expected.count
+        assert digest.quantile(QUANTILES) == pytest.approx(expected.quantile(QUANTILES))
+
+
+def test_digests_folded_by_chunk_match_the_whole_history():
+    values = durations(60000)
+    slots = np.arange(len(values)) % 2 * 5
+    keys = [pd.Series(['home'] * len(values)), pd.Series(['work'] * len(values)),
+            pd.Series(np.ones(len(values), dtype='int64')), pd.Series(slots)]
+    digests = {}
+    for chunk in np.array_split(np.arange(len(values)), 6):
+        digests = fold_digests(digests, [key.iloc[chunk] for key in keys], pd.Series(values[chunk]))
+    assert sorted(digests) == [('home', 'work', 1, 0), ('home', 'work', 1, 5)]
+    for (_, _, _, slot), digest in digests.items():
+        ordered = np.sort(values[slots == slot])
+        assert digest.count == len(ordered)
+        assert max(rank_error(ordered, digest.quantile(q), q) for q in QUANTILES) < 0.02
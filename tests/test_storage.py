@@ -0,0 +1,104 @@
+import os
+import glob
+import json
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+import storage  # noqa: E402
+
+
+def samples(minutes, day='2019-04-01'):
+    times = pd.Timestamp(day) + pd.to_timedelta(minutes, unit='m')
+    return pd.DataFrame({'distance': '10.0 km', 'duration_in_traffic': ['{} mins'.format(20 + m % 10) for m in minutes],
+                         'destination': 'work', 'origin': 'home', 'time': times})
+
+
+@pytest.fixture
+def store(tmp_path):
+    root = str(tmp_path / 'store')
+    for start in range(0, 30, 10):
+        storage.write_samples(samples(range(start, start + 10)), root)
+    return root
+
+
+def partition(root):
+    return storage.partitions(root)[0]
+
+
+def test_compact_merges_the_files_of_a_partition(store):
+    before = storage.read_samples(store)
+    assert storage.compact(store) == 1
+    assert len(glob.glob(os.path.join(partition(store), 'part-*.parquet'))) == 1
+    assert not os.path.exists(os.path.join(partition(store), storage.COMPACTION))
+    pd.testing.assert_frame_equal(storage.read_samples(store), before)
+
+
+def publish_without_cleanup(monkeypatch):
+    """compact interrupted right after publishing its merged file"""
+    monkeypatch.setattr(storage, '_finish_compaction', lambda directory, stale_seconds=None: True)
+
+
+def test_readers_skip_replaced_files_once_the_merged_file_is_published(store, monkeypatch):
+    before = storage.read_samples(store)
+    with monkeypatch.context() as patched:
+        publish_without_cleanup(patched)
+        storage.compact(store)
+    assert len(glob.glob(os.path.join(partition(store), 'part-*.parquet'))) == 4
+    pd.testing.assert_frame_equal(storage.read_samples(store), before)
+    assert sum(len(chunk) for chunk in storage.iter_samples(store)) == len(before)
+    storage.remove_partial(store)
+    assert len(glob.glob(os.path.join(partition(store), 'part-*.parquet'))) == 1
+    assert not os.path.exists(os.path.join(partition(store), storage.COMPACTION))
+    pd.testing.assert_frame_equal(storage.read_samples(store), before)
+
+
+def test_a_compaction_that_never_published_is_dropped_once_stale(store):
+    before = storage.read_samples(store)
+    record = os.path.join(partition(store), storage.COMPACTION)
+    replaced = [os.path.basename(path) for path in glob.glob(os.path.join(partition(store), 'part-*'))]
+    with open(record, 'w') as f:
+        json.dump({'merged': 'part-0-crashed.parquet', 'replaced': replaced}, f)
+    pd.testing.assert_frame_equal(storage.read_samples(store), before)
+    # Still fresh, so it may be a compaction in progress that compact must leave alone
+    assert storage.compact(store) == 0
+    storage.remove_partial(store, stale_seconds=-1)
+    assert not os.path.exists(record)
+    assert storage.compact(store) == 1
+    pd.testing.assert_frame_equal(storage.read_samples(store), before)
+
+
+def test_readers_relist_a_partition_when_a_compaction_finishes_meanwhile(store, monkeypatch):
+    before = storage.read_samples(store)
+    part_files = storage._part_files
+    listings = []
+
+    def listed_before_compaction(directory):
+        files = part_files(directory)
+        listings.append(files)
+        if len(listings) == 1:
+            storage.compact(store)
+        return files
+
+    monkeypatch.setattr(storage, '_part_files', listed_before_compaction)
+    pd.testing.assert_frame_equal(storage.read_samples(store), before)
+    # The reader's first listing, compact's own and the reader's second one
+    assert [len(files) for files in listings] == [3, 3, 1]
+
+
+def test_iter_samples_combines_partitions_up_to_chunksize(tmp_path):
+    root = str(tmp_path / 'store')
+    for day in pd.date_range('2019-04-01', periods=6):
+        storage.write_samples(samples(range(10), day), root)
+    sizes = [len(chunk) for chunk in storage.iter_samples(root, chunksize=25)]
+    assert sizes == [30, 30]
+    assert [len(chunk) for chunk in storage.iter_samples(root, chunksize=1)] == [10] * 6
+    assert [len(chunk) for chunk in storage.iter_samples(root, start='2019-04-02', chunksize=1000)] == [50]
+    pd.testing.assert_frame_equal(pd.concat(storage.iter_samples(root, chunksize=25), ignore_index=True),
+                                  storage.read_samples(root))
+
+
+def test_reading_no_partitions_gives_the_sample_columns(store):
+    df = storage.read_samples(store, start='2025-01-01')
+    assert df.empty
+    assert list(df.columns) == ['distance', 'duration_in_traffic', 'destination', 'origin', 'time']
@@ -1,18 +1,39 @@
 """This is a script to collect the duration of a commute from google maps"""
 
-import pandas as pd
-import requests
 import datetime
-import os.path
+from maps_client import DISTANCE_MATRIX_URL, MapsClient
+from sample_writer import append_csv
+from response_archive import ARCHIVE_DIR, ResponseArchive
 from google_api import PASSWORD
 
 # Replace with the coordinates of your own home and work
 HOME = '42.339165, -71.152060'
 WORK = '42.504682, -71.244258'
+# Add further (home, work) pairs to collect several commutes with the same requests
+ROUTES = [(HOME, WORK)]
 # Replace PASSWORD with your own Google API password
 PWORD = PASSWORD
 PATH = './commute_info.csv'
 
+# Elements used per day are counted here so every run shares the daily quota
+QUOTA_PATH = './collector_quota.json'
+
+
+def batch_commute_times(routes, api_key, session=None, time_now=None, url=DISTANCE_MATRIX_URL, client=None):
+    """Collects commute information for a list of (origin, destination) routes using as
+    few API requests as possible over one session. Returns a dataframe with one row
+    per route that google returned a traffic duration for. Pass a MapsClient to share
+    its cache, rate limit and quota across calls."""
+    client = client or MapsClient(api_key, url=url, session=session)
+    return client.commute_times(routes, time_now)
+
+
+def commute_routes(routes, time_now):
+    """Orients (home, work) pairs for the direction of travel, hours are UTC for commute"""
+    if time_now.hour < 18:
+        return list(routes)
+    return [(work, home) for home, work in routes]
+
 
 def commute_time_calculator(home, work, api_key):
     """Pings google API and returns commute information.
@@ -20,47 +41,28 @@ def commute_time_calculator(home, work, api_key):
     as one unified string each, hours for direction are UTC for commute.
     Maps API defaults to 'best guess' for traffic duration, a combination of historical
     averages and live traffic information."""
-    time_now = datetime.datetime.now()
-    if time_now.hour < 18:
-        start_coord = home
-        end_coord = work
-    else:
-        start_coord = work
-        end_coord = home
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json?origins={}&destinations={}&mode=driving&language=en-EN&departure_time=now&key={}".format(start_coord, end_coord, api_key)
-    try:
-        duration = requests.get(url)
-    except:
-        print "There is something wrong with the URL or your coordinates"
-    result = duration.json()
-    commute = {}
-    commute['distance'] = result['rows'][0]['elements'][0]['distance']['text']
-    commute['duration_in_traffic'] = result['rows'][0]['elements'][0]['duration_in_traffic']['text']
-    commute['destination'] = result['destination_addresses']
-    commute['origin'] = result['origin_addresses']
-    commute['time'] = time_now
-    df = pd.DataFrame(commute, index=[0])
-    return df
+    time_now = datetime.datetime.utcnow()
+    return batch_commute_times(commute_routes([(home, work)], time_now), api_key, time_now=time_now)
 
 
 def csv_writer(df, path):
     """Feed the path/name you want to CSV to save to as well as the
-    dataframe from your new commute_time_calculator trip"""
-    if os.path.exists(path):
-        with open(path, 'a') as f:
-            df.to_csv(f, header=False, index=False)
-            print "Successfully appended to CSV"
-    else:
-        df.to_csv(path, index=False)
-        print "Successfully created CSV"
+    dataframe from your new commute_time_calculator trip. The rows are appended in one
+    locked write that survives crashes, see sample_writer.append_csv"""
+    append_csv(df, path)
+    print("Successfully appended {} rows to CSV".format(len(df)))
 
 
 def main():
-    frame = commute_time_calculator(HOME, WORK, PWORD)
+    time_now = datetime.datetime.utcnow()
+    with ResponseArchive(ARCHIVE_DIR) as archive:
+        client = MapsClient(PWORD, quota_path=QUOTA_PATH, archive=archive)
+        frame = batch_commute_times(commute_routes(ROUTES, time_now), PWORD, time_now=time_now, client=client)
     csv_writer(frame, PATH)
-    print "Successfully Obtained Trip Info!!"
+    print("Successfully Obtained Trip Info for {} routes!!".format(len(frame)))
+    print(client.metrics_summary())
 
 
 if __name__ == "__main__":
-    print "Starting trip duration retrieval"
+    print("Starting trip duration retrieval")
     main()